@@ -1,9 +1,15 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, BackgroundTasks
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from sqlmodel import select
-from typing import List, Optional, Tuple
+from sqlmodel import select, update
+from typing import Dict, List, Optional, Tuple
 import re
+import sys
+import heapq
+import logging
 from datetime import datetime, timedelta, time, timezone
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
 
 try:
     from zoneinfo import ZoneInfo
@@ -15,26 +21,15 @@ from app.models.db import (
     get_session,
     Message,
     Lead,
-    init_db,
     get_lead_by_session,
     merge_lead,
 )
 from app.core.calendar import get_slots
-from app.core.pipefy import update_card_lead_fields, create_card, find_card_by_email, FIELD_NAMES, _ensure_field_ids_initialized
+from app.core.pipefy import update_card_lead_fields, create_card, find_card_by_email, is_pipefy_card_id, FIELD_NAMES, PIPEFY_PIPE_ID
 from app.core.config import settings
-import os
 
 router = APIRouter()
-
-_db_initialized = False
-def _ensure_db():
-    global _db_initialized
-    if not _db_initialized:
-        try:
-            init_db()
-            _db_initialized = True
-        except Exception as e:
-            print(f"[CHAT] ⚠️ Erro ao inicializar DB (pode ser normal): {e}")
+logger = logging.getLogger(__name__)
 
 BRT = ZoneInfo("America/Sao_Paulo")
 SESSION_TTL_HOURS = settings.SESSION_TTL_HOURS
@@ -43,96 +38,168 @@ class ChatIn(BaseModel):
     message: str
     sessionId: str
 
-def load_history(db, session_id: str, limit: int = 20) -> List[dict]:
-    stmt = select(Message).where(Message.session_id == session_id).order_by(Message.ts.asc())
-    rows = db.exec(stmt).all()
-    return [{"role": m.role, "content": m.content, "ts": m.ts.isoformat()} for m in rows][-limit:]
-
-def is_session_expired(db, session_id: str) -> Tuple[bool, Optional[datetime]]:
+def _recent_messages(db, session_id: str, limit: int = 20) -> list:
     """
-    Verifica se a sessão expirou baseado na última mensagem.
-    Retorna (is_expired, last_activity) onde last_activity é o timestamp da última mensagem.
+    Últimas `limit` mensagens da sessão, em ordem cronológica.
+    Projeta só (role, content, ts) e deixa o LIMIT no banco: não hidrata o histórico inteiro.
     """
-    stmt = select(Message).where(Message.session_id == session_id).order_by(Message.ts.desc())
-    last_message = db.exec(stmt).first()
-    
-    if not last_message:
-        return False, None
-    
-    last_activity = last_message.ts
-    now = datetime.utcnow()
-    ttl = timedelta(hours=settings.SESSION_TTL_HOURS)
-    
-    is_expired = (now - last_activity) > ttl
-    return is_expired, last_activity
+    stmt = (
+        select(Message.role, Message.content, Message.ts)
+        .where(Message.session_id == session_id)
+        .order_by(Message.ts.desc(), Message.id.desc())
+        .limit(limit)
+    )
+    rows = db.exec(stmt).all()
+    rows.reverse()
+    return rows
+
+def _history_entry(m) -> dict:
+    return {"role": m.role, "content": m.content, "ts": m.ts.isoformat()}
+
+def load_history(db, session_id: str, limit: int = 20) -> List[dict]:
+    return [_history_entry(m) for m in _recent_messages(db, session_id, limit)]
+
+def _is_expired(last_activity: datetime) -> bool:
+    return (datetime.utcnow() - last_activity) > timedelta(hours=settings.SESSION_TTL_HOURS)
+
+# Offset fixo de Brasília (sem horário de verão desde 2019): converter slots com ele é só aritmética,
+# sem consultar as transições do ZoneInfo
+_BRT_OFFSET = timezone(timedelta(hours=-3))
 
 def _to_brt(dt: datetime) -> datetime:
-    return dt.astimezone(BRT)
+    return dt.astimezone(_BRT_OFFSET)
 
-def _brt_hour_from_iso(iso: str) -> int:
-    dt = datetime.fromisoformat(iso.replace("Z", "+00:00"))
-    return _to_brt(dt).hour
+# fromisoformat aceita o sufixo 'Z' a partir do Python 3.11
+_FROMISO_ACCEPTS_Z = sys.version_info >= (3, 11)
 
-def _brt_minute_from_iso(iso: str) -> int:
-    dt = datetime.fromisoformat(iso.replace("Z", "+00:00"))
-    return _to_brt(dt).minute
+def _parse_slot_iso(s: str) -> datetime:
+    """
+    Parse de horários de slot. Cal.com devolve 'YYYY-MM-DDTHH:MM:SSZ' ou
+    'YYYY-MM-DDTHH:MM:SS.fffZ': esses formatos fixos são lidos por fatiamento;
+    qualquer outro (ex.: '+00:00', '-03:00') cai no fromisoformat.
+    """
+    if s[-1:] == "Z" and (len(s) == 20 or (len(s) == 24 and s[19] == ".")):
+        return datetime(
+            int(s[0:4]), int(s[5:7]), int(s[8:10]),
+            int(s[11:13]), int(s[14:16]), int(s[17:19]),
+            int(s[20:23]) * 1000 if len(s) == 24 else 0,
+            tzinfo=timezone.utc,
+        )
+    return datetime.fromisoformat(s if _FROMISO_ACCEPTS_Z else s.replace("Z", "+00:00"))
 
-def filter_slots_by_window(slots: List[dict], rs: datetime, re: datetime) -> List[dict]:
+@lru_cache(maxsize=1024)
+def _slot_start_brt(iso: str) -> datetime:
     """
-    Mantém apenas slots cujo horário BRT esteja dentro de [rs, re).
-    Considera hora:minuto (não apenas hora cheia).
+    Converte o início ISO de um slot para BRT.
+    Memoizado pela string: filtro, clamp e ordenação reutilizam o mesmo parse.
     """
-    start_brt = _to_brt(rs)
-    end_brt   = _to_brt(re)
-    out = []
-    for s in slots:
+    return _to_brt(_parse_slot_iso(iso))
+
+def _select_slots(
+    slots: List[dict],
+    rs: datetime,
+    re: datetime,
+    alvo_h: Optional[int],
+    modo: str,
+    limit: int = 5,
+) -> List[dict]:
+    """
+    Seleciona até `limit` slots numa única passada (cada início é lido uma vez):
+    - mantém apenas slots dentro de [rs, re) (datetimes aware: comparação direta, sem converter os limites)
+    - modo "after" (ex.: 'a partir das 15'): descarta slots antes de alvo_h
+    - com hora alvo, prioriza pela distância a ela (em BRT); sem alvo, mantém a ordem original
+    Com hora alvo, guarda só os `limit` melhores num heap limitado (empates: ordem original).
+    """
+    after_h = alvo_h if modo == "after" else None
+    picked = []  # sem alvo: slots; com alvo: heap de (-distância, -índice, slot)
+    for i, s in enumerate(slots):
         slot_start_str = s.get("start", "")
         if not slot_start_str:
             continue
-        if slot_start_str.endswith("Z"):
-            slot_start_str = slot_start_str[:-1] + "+00:00"
-        try:
-            dt_start = datetime.fromisoformat(slot_start_str).astimezone(BRT)
-            if start_brt <= dt_start < end_brt:
-                out.append(s)
-        except Exception:
-            pass
-    return out
-
-def clamp_after_hour(slots: List[dict], h_min: int) -> List[dict]:
-    """Garante slots >= h_min em BRT (ex.: 'a partir das 15')."""
-    out = []
-    for s in slots:
         try:
-            hour = _brt_hour_from_iso(s["start"])
-            if hour >= h_min:
-                out.append(s)
+            dt_start = _slot_start_brt(slot_start_str)
         except Exception:
-            out.append(s)
-    return out
-
-def _is_pipefy_card_id(session_id: str) -> bool:
-    """
-    Verifica se sessionId parece ser um card_id do Pipefy.
-    Card IDs do Pipefy são geralmente numéricos e longos.
-    """
-    if not session_id:
-        return False
-    return session_id.isdigit() and len(session_id) >= 6
-
-def prioritize_slots(slots: List[dict], alvo_h: Optional[int]) -> List[dict]:
-    """Ordena por distância à hora alvo (em BRT) se houver alvo."""
-    if alvo_h is None or not slots:
-        return slots
-    return sorted(
-        slots,
-        key=lambda s: abs(_brt_hour_from_iso(s["start"]) - alvo_h) + (_brt_minute_from_iso(s["start"]) / 60.0)
-    )
+            continue
+        if not (rs <= dt_start < re):
+            continue
+        if after_h is not None and dt_start.hour < after_h:
+            continue
+        if alvo_h is None:
+            picked.append(s)
+            if len(picked) == limit:
+                break
+        else:
+            dist = abs(dt_start.hour - alvo_h) + (dt_start.minute / 60.0)
+            if len(picked) < limit:
+                heapq.heappush(picked, (-dist, -i, s))
+            elif dist < -picked[0][0]:
+                heapq.heapreplace(picked, (-dist, -i, s))
+    if alvo_h is None:
+        return picked
+    picked.sort(reverse=True)
+    return [s for _, _, s in picked]
+
+_WEEKDAY_ABBR = ("seg", "ter", "qua", "qui", "sex", "sáb", "dom")
+
+def _fmt_slot(s: dict) -> str:
+    """Ex.: 'qua 12/11 às 14:00' (horário de Brasília)"""
+    dt = _slot_start_brt(s["start"])
+    return f"{_WEEKDAY_ABBR[dt.weekday()]} {dt.strftime('%d/%m')} às {dt.strftime('%H:%M')}"
+
+def _slot_offer_text(slots: List[dict], intro: str = "") -> str:
+    return f"{intro}Temos estes horários disponíveis: {', '.join(_fmt_slot(s) for s in slots)}. Algum deles funciona pra você?"
+
+def _collected(value: Optional[str], placeholder: str) -> Optional[str]:
+    """Retorna o valor coletado, ou None se vazio/placeholder."""
+    return value if value and value != placeholder else None
+
+def _sync_card_fields(**fields) -> None:
+    """Sincroniza os dados do lead no card do Pipefy (roda como BackgroundTask, após a resposta)."""
+    try:
+        update_card_lead_fields(**fields)
+    except Exception as e:
+        logger.warning("[CHAT] Erro ao sincronizar lead no Pipefy (card %s): %s", fields.get("card_id"), e)
 
+# Os parsers removem acentos da mensagem uma vez; chaves, palavras-chave e regex abaixo são todas sem acento
+_ACCENT_TRANS = str.maketrans("áàâãéêíóôõúç", "aaaaeeiooouc")
 WEEKDAYS = {
-    "segunda": 0, "terça": 1, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sábado": 5, "sabado": 5, "domingo": 6
+    "segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6
 }
 
+# Palavras que antecedem o dia da semana ("na sexta", "próxima quarta")
+_WEEKDAY_PREFIXES = {"na", "no", "proxima", "proximo"}
+
+# Regex pré-compiladas (usadas a cada mensagem em parse_date_pt / parse_time_prefs_pt)
+_RE_DIA = re.compile(r"\bdia\s+(\d{1,2})\b")
+_RE_DMY = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
+_RE_STRIP_DATE = re.compile(r"\bdia\s+\d{1,2}\b|\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b")
+_RE_AFTER = re.compile(r"(a partir|apos|depois)\s+(?:d?as?\s*)?(\d{1,2})h?")
+_RE_NUMS = re.compile(r"\b(\d{1,2})h?\b")
+_RE_AROUND = re.compile(r"(proximo|perto|as?)\s*(\d{1,2})h?")
+_RE_ATE = re.compile(r"\bate\b")  # "até" como palavra, mesmo com pontuação colada ("até,")
+_RE_DIGIT = re.compile(r"\d")
+_RE_WORD = re.compile(r"[\w-]+")  # palavras com hífen ("sexta-feira"), sem pontuação/aspas/parênteses
+
+# Tokens sem os quais as regex acima nunca casam: evita rodá-las em mensagens comuns ("oi", "quero agendar")
+_DATE_TRIGGERS = ("dia", "/") + tuple(WEEKDAYS)
+_TIME_TRIGGERS = ("manh", "tarde", "almoco")
+
+# Menção explícita a dia/horário, por palavra inteira: "dia 10", "10/11", "14h", "14:30", dia da semana,
+# período ("tarde" de "boa tarde" ainda casa, mas só conta para lead já pronto para a oferta)
+_RE_SCHEDULE = re.compile(
+    r"\b(?:hoje|amanha|dia\s+\d{1,2}|\d{1,2}/\d{1,2}|\d{1,2}(?::\d{2}|\s*h(?:s|oras?)?)|manha|tarde|almoco|"
+    + "|".join(WEEKDAYS)
+    + r")\b"
+)
+
+# Busca especulativa de slots em paralelo com o LLM (ver chat()); poucas threads bastam,
+# cada uma só espera a resposta do Cal.com
+_SLOTS_PREFETCH = ThreadPoolExecutor(max_workers=4, thread_name_prefix="slots-prefetch")
+
+def _mentions_schedule(text: str) -> bool:
+    """Mensagem fala de dia/horário (data, hora, dia da semana, "manhã", "tarde"...)."""
+    return _RE_SCHEDULE.search(text.lower().translate(_ACCENT_TRANS)) is not None
+
 def _today_brt() -> datetime:
     return datetime.now(BRT)
 
@@ -143,12 +210,22 @@ def _next_weekday(base_date, target_wd: int, include_today=False):
         delta = 7
     return base_date + timedelta(days=delta)
 
+def _find_weekday(t: str) -> Optional[int]:
+    """Procura '<na|no|próxima> <dia da semana>' nos tokens da mensagem (ex.: 'na sexta-feira,')."""
+    toks = _RE_WORD.findall(t)
+    for i in range(len(toks) - 1):
+        if toks[i] in _WEEKDAY_PREFIXES:
+            wd = WEEKDAYS.get(toks[i + 1].split("-", 1)[0])
+            if wd is not None:
+                return wd
+    return None
+
 def parse_date_pt(text: str) -> Tuple[datetime, bool]:
     """
     Retorna (data_base_BRT 00:00, menciona_amanha)
     Entende: hoje, amanhã, 'dia 10', '10/11', '10/11/2025', 'na sexta', 'próxima quarta'.
     """
-    t = (text or "").lower()
+    t = (text or "").lower().translate(_ACCENT_TRANS)
     now = _today_brt()
     base = now.date()
     mentions_tomorrow = False
@@ -161,13 +238,15 @@ def parse_date_pt(text: str) -> Tuple[datetime, bool]:
     if "hoje" in t:
         return datetime.combine(base, time(0,0), tzinfo=BRT), mentions_tomorrow
 
-    m = re.search(r"(pr[óo]xima?|na|no)\s+(segunda|ter[çc]a|quarta|quinta|sexta|s[áa]bado|domingo)", t)
-    if m:
-        wd = WEEKDAYS[m.group(2)]
+    if not any(tok in t for tok in _DATE_TRIGGERS):
+        return datetime.combine(base, time(0,0), tzinfo=BRT), mentions_tomorrow
+
+    wd = _find_weekday(t)
+    if wd is not None:
         nxt = _next_weekday(base, wd, include_today=("hoje" in t))
         return datetime.combine(nxt, time(0,0), tzinfo=BRT), mentions_tomorrow
 
-    m = re.search(r"\bdia\s+(\d{1,2})\b", t)
+    m = _RE_DIA.search(t)
     if m:
         d = int(m.group(1))
         month = now.month
@@ -177,7 +256,7 @@ def parse_date_pt(text: str) -> Tuple[datetime, bool]:
         except ValueError:
             pass
 
-    m = re.search(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b", t)
+    m = _RE_DMY.search(t)
     if m:
         d, mo, yr = int(m.group(1)), int(m.group(2)), int(m.group(3)) if m.group(3) else now.year
         if yr < 100:
@@ -196,93 +275,105 @@ def parse_time_prefs_pt(text: str) -> Tuple[Optional[int], Optional[int], Option
     Regras: entende manhã/tarde; 'a partir/após/depois de X'; 'X até Y';
             'próximo/perto/às X'; hora solta '15' como fallback.
     """
-    t_raw = (text or "").lower()
-    t = re.sub(r"\bdia\s+\d{1,2}\b", "", t_raw)
-    t = re.sub(r"\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b", "", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    if any(k in t for k in ["manhã","manha","de manhã","de manha"]):
+    t_raw = (text or "").lower().translate(_ACCENT_TRANS)
+    if not _RE_DIGIT.search(t_raw) and not any(tok in t_raw for tok in _TIME_TRIGGERS):
+        return None, None, None, "none"
+    # Remove 'dia NN' e 'dd/mm[/aaaa]' numa passada só; split/join normaliza os espaços
+    t = " ".join(_RE_STRIP_DATE.sub("", t_raw).split())
+    if "manha" in t:
         return 8, 12, None, "period"
-    if any(k in t for k in ["tarde","à tarde","a tarde","depois do almoço","mais tarde"]):
+    if "tarde" in t or "depois do almoco" in t:
         return 13, 18, None, "period"
 
-    m = re.search(r"(a partir|ap[óo]s|depois)\s+(?:d?[àa]s?\s*)?(\d{1,2})h?", t)
+    m = _RE_AFTER.search(t)
     if m:
         h = min(max(int(m.group(2)), 0), 23)
         return h, 20, h, "after"
 
-    nums = re.findall(r"\b(\d{1,2})h?\b", t)
-    if "até" in t and len(nums) >= 2:
+    nums = _RE_NUMS.findall(t)
+    if _RE_ATE.search(t) and len(nums) >= 2:
         h1, h2 = int(nums[0]), int(nums[1])
         return min(h1, h2), max(h1, h2), (h1 + h2)//2, "range"
 
-    m = re.search(r"(pr[óo]ximo|perto|[àa]s?)\s*(\d{1,2})h?", t)
+    m = _RE_AROUND.search(t)
     if m:
         h = min(max(int(m.group(2)), 0), 23)
         return max(8, h-2), min(20, h+2), h, "around"
 
-    nums = re.findall(r"\b(\d{1,2})h?\b", t)
+    nums = _RE_NUMS.findall(t)
     if nums:
         h = min(max(int(nums[-1]), 0), 23)
         return max(8, h-2), min(20, h+2), h, "around"
 
     return None, None, None, "none"
 
-def plan_windows(text: str) -> Tuple[datetime, datetime, Optional[int], str, List[Tuple[datetime,datetime]]]:
+def plan_windows(text: str, parsed_date: Optional[Tuple[datetime, bool]] = None) -> Tuple[datetime, datetime, Optional[int], str, List[Tuple[datetime,datetime]]]:
     """
     Constrói janelas (BRT→UTC) priorizadas:
     - data pedida (ou hoje) com preferências de hora
     - se zero slots e usuário não disse 'amanhã', tenta mesma janela +1 dia
     - fallback: dia inteiro da data base (ou de amanhã)
+    `parsed_date`: resultado de parse_date_pt(text), se o chamador já o tiver.
     Retorna: (startUTC, endUTC, alvo_h, modo, fallback_listUTC)
     """
-    base_brt, said_tomorrow = parse_date_pt(text)
+    base_brt, said_tomorrow = parsed_date or parse_date_pt(text)
     sh, eh, alvo, modo = parse_time_prefs_pt(text)
 
     if sh is None and eh is None:
         sh, eh = (13, 18) if said_tomorrow else (9, 18)
 
-    start_brt = datetime.combine(base_brt.date(), time(sh, 0, tzinfo=BRT))
-    end_brt   = datetime.combine(base_brt.date(), time(eh, 0, tzinfo=BRT))
-    start_utc = start_brt.astimezone(timezone.utc)
-    end_utc   = end_brt.astimezone(timezone.utc)
+    # Offset BRT→UTC calculado uma vez (sem horário de verão desde 2019); o resto é aritmética
+    d = base_brt.date()
+    offset = BRT.utcoffset(datetime.combine(d, time(sh, 0)))
+    day_utc = datetime(d.year, d.month, d.day, tzinfo=timezone.utc) - offset  # 00:00 BRT em UTC
+    start_utc = day_utc + timedelta(hours=sh)
+    end_utc   = day_utc + timedelta(hours=eh)
 
     fallbacks: List[Tuple[datetime,datetime]] = []
 
     if not said_tomorrow:
-        fs = (start_brt + timedelta(days=1)).astimezone(timezone.utc)
-        fe = (end_brt + timedelta(days=1)).astimezone(timezone.utc)
-        fallbacks.append((fs, fe))
+        fallbacks.append((start_utc + timedelta(days=1), end_utc + timedelta(days=1)))
 
-    whole = base_brt.date() if said_tomorrow else (base_brt + timedelta(days=1)).date()
-    ws = datetime.combine(whole, time(0,0), tzinfo=BRT).astimezone(timezone.utc)
-    we = datetime.combine(whole, time(23,59,59), tzinfo=BRT).astimezone(timezone.utc)
+    ws = day_utc if said_tomorrow else day_utc + timedelta(days=1)
+    we = ws + timedelta(hours=23, minutes=59, seconds=59)
     fallbacks.append((ws, we))
 
     return start_utc, end_utc, alvo, modo, fallbacks
 
 @router.post("/chat")
-def chat(body: ChatIn):
-    _ensure_db()
-    _ensure_field_ids_initialized()
-    
+def chat(body: ChatIn, background_tasks: BackgroundTasks):
     original_session_id = body.sessionId
     session_id = original_session_id
+    pipe_id = PIPEFY_PIPE_ID
     
-    with get_session() as temp_db:
-        expired, last_activity = is_session_expired(temp_db, session_id)
-        if expired:
-            return {
+    # Memo por requisição: o mesmo email pode ser consultado até 3x no Pipefy
+    card_cache: Dict[str, Optional[str]] = {}
+    
+    def _lookup_card(email: str) -> Optional[str]:
+        if email not in card_cache:
+            card_cache[email] = find_card_by_email(pipe_id, email)
+        return card_cache[email]
+    
+    # As escritas de antes do LLM (merge, troca de sessão, migração) são commitadas antes das chamadas
+    # externas: a transação de escrita do SQLite não fica aberta durante LLM, Pipefy e Cal.com
+    with get_session() as db:
+        pending_writes = False
+        # Uma única leitura das últimas mensagens serve para a expiração e para o histórico
+        recent = _recent_messages(db, original_session_id)
+        if recent and _is_expired(recent[-1].ts):
+            return JSONResponse({
                 "reply": "Sua sessão expirou por inatividade. Por favor, recarregue a página para iniciar uma nova conversa.",
                 "action": {"type": "SESSION_EXPIRED"},
                 "sessionId": session_id,
-            }
-    
-    old_lead_data = None
-    existing_card_id = None
-    
-    try:
-        with get_session() as temp_db:
-            old_lead = get_lead_by_session(temp_db, original_session_id)
+            })
+        original_history = [_history_entry(m) for m in recent]
+        
+        old_lead = None
+        old_lead_data = None
+        existing_card_id = None
+        
+        try:
+            old_lead = get_lead_by_session(db, original_session_id)
             if old_lead and (old_lead.name or old_lead.email or old_lead.company):
                 old_lead_data = {
                     "name": old_lead.name,
@@ -297,65 +388,71 @@ def chat(body: ChatIn):
                         (Lead.name == old_lead_data.get("name")) &
                         (Lead.email == old_lead_data.get("email")) &
                         (Lead.session_id != original_session_id)
-                    )
-                    matching_lead = temp_db.exec(stmt).first()
-                    if matching_lead and _is_pipefy_card_id(matching_lead.session_id):
+                    ).limit(1)
+                    matching_lead = db.exec(stmt).first()
+                    if matching_lead and is_pipefy_card_id(matching_lead.session_id):
                         existing_card_id = matching_lead.session_id
             except Exception:
                 pass
-    except Exception:
-        pass
-    
-    if existing_card_id:
-        session_id = existing_card_id
-        body.sessionId = session_id
-    
-    with get_session() as db:
-        try:
-            db.add(Message(session_id=session_id, role="user", content=body.message))
-            db.commit()
-
+        except Exception:
+            db.rollback()
+            old_lead = None
+        
+        if existing_card_id:
+            session_id = existing_card_id
+            body.sessionId = session_id
+        
+        # A mensagem do usuário só é gravada no commit final, junto com a resposta
+        user_message = Message(session_id=session_id, role="user", content=body.message)
+        user_entry = _history_entry(user_message)
+        if session_id == original_session_id:
+            original_history = (original_history + [user_entry])[-20:]
+
+        if old_lead is not None and session_id == original_session_id:
+            lead = old_lead
+        else:
             lead = get_lead_by_session(db, session_id)
-            
-            if session_id != original_session_id and old_lead_data and not (lead.name and lead.email):
-                merged_old = merge_lead(lead, old_lead_data)
-                db.add(merged_old)
-                db.commit()
-                db.refresh(merged_old)
-                lead = merged_old
-            
-            if lead.email and "@" in lead.email and not _is_pipefy_card_id(session_id):
-                try:
-                    pipe_id = os.getenv("PIPEFY_PIPE_ID", "306783445")
-                    existing_card_id = find_card_by_email(pipe_id, lead.email)
-                    
-                    if existing_card_id:
-                        lead.interest_confirmed = None
-                        session_id = str(existing_card_id)
-                        body.sessionId = session_id
-                        lead.session_id = session_id
-                        db.add(lead)
-                        db.commit()
-                        db.refresh(lead)
-                except Exception:
-                    pass
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            raise
         
-        history = load_history(db, session_id)
-        if not history and session_id != original_session_id:
-            old_history = load_history(db, original_session_id)
-            if old_history:
-                for msg in old_history:
-                    msg_obj = Message(session_id=session_id, role=msg["role"], content=msg["content"])
-                    db.add(msg_obj)
-                db.commit()
-                history = load_history(db, session_id)
+        if session_id != original_session_id and old_lead_data and not (lead.name and lead.email):
+            merged_old = merge_lead(lead, old_lead_data)
+            db.add(merged_old)
+            lead = merged_old
+            pending_writes = True
+        
+        if lead.email and "@" in lead.email and not is_pipefy_card_id(session_id):
+            try:
+                existing_card_id = _lookup_card(lead.email)
+                
+                if existing_card_id:
+                    lead.interest_confirmed = None
+                    session_id = str(existing_card_id)
+                    body.sessionId = session_id
+                    lead.session_id = session_id
+                    db.add(lead)
+                    pending_writes = True
+            except Exception:
+                pass
+        
+        if session_id == original_session_id:
+            history = original_history
+        else:
+            history = load_history(db, session_id)
+            if user_message.session_id == session_id:
+                history = (history + [user_entry])[-20:]
+            elif not history and original_history:
+                # Move o histórico da sessão original para o card com um único UPDATE;
+                # as mensagens já estão hidratadas em original_history
+                db.exec(
+                    update(Message)
+                    .where(Message.session_id == original_session_id)
+                    .values(session_id=session_id)
+                )
+                user_message.session_id = session_id
+                history = original_history
+                pending_writes = True
         
         is_re_engagement = (
-            _is_pipefy_card_id(session_id) and 
+            is_pipefy_card_id(session_id) and 
             session_id != original_session_id and
             lead.email and "@" in lead.email and
             lead.interest_confirmed is False
@@ -364,11 +461,10 @@ def chat(body: ChatIn):
         if is_re_engagement:
             lead.interest_confirmed = None
             db.add(lead)
-            db.commit()
-            db.refresh(lead)
+            pending_writes = True
 
         is_re_engagement_detected = (
-            _is_pipefy_card_id(session_id) and 
+            is_pipefy_card_id(session_id) and 
             session_id != original_session_id
         )
         
@@ -390,6 +486,25 @@ def chat(body: ChatIn):
                 "history": history,
             }
 
+        if pending_writes:
+            db.commit()
+
+        # A janela de horários depende só da mensagem: se o turno provavelmente vai terminar
+        # oferecendo slots, a consulta ao Cal.com já sai em paralelo com o LLM (o resultado é
+        # descartado se o LLM não confirmar interesse)
+        slot_plan = None
+        slots_prefetch: Optional[Future] = None
+        ready_for_offer = lead.interest_confirmed is True or (
+            lead.interest_confirmed is None
+            and lead.name and lead.email and "@" in lead.email and lead.company and lead.need
+            and _mentions_schedule(body.message)
+        )
+        if ready_for_offer:
+            base_brt, said_tomorrow = parse_date_pt(body.message)
+            slot_plan = (base_brt, said_tomorrow, plan_windows(body.message, (base_brt, said_tomorrow)))
+            rs, re = slot_plan[2][:2]
+            slots_prefetch = _SLOTS_PREFETCH.submit(get_slots, rs, re)
+
         resp = llm.respond(build_state(), body.message)
         action_type = (resp.get("action") or {}).get("type")
         
@@ -397,21 +512,22 @@ def chat(body: ChatIn):
         if action_type == "NO_INTEREST":
             lead_partial_from_llm = resp.get("leadPartial") or {}
             # Apenas salva a mensagem do usuário e a resposta do LLM, sem coletar dados
-            db.add(Message(session_id=session_id, role="assistant", content=resp.get("reply", "")))
+            db.add_all([user_message, Message(session_id=session_id, role="assistant", content=resp.get("reply", ""))])
             db.commit()
-            return {
+            return JSONResponse({
                 "reply": resp.get("reply", ""),
                 "action": resp.get("action"),
                 "sessionId": session_id,
-            }
+            })
         
         lead_partial_from_llm = resp.get("leadPartial") or {}
+        pre_merge_email = lead.email
         merged = merge_lead(lead, lead_partial_from_llm)
         
-        if merged.email and "@" in merged.email and not _is_pipefy_card_id(session_id):
+        # Email inalterado já foi consultado antes do LLM (e está em card_cache)
+        if merged.email and merged.email != pre_merge_email and "@" in merged.email and not is_pipefy_card_id(session_id):
             try:
-                pipe_id = os.getenv("PIPEFY_PIPE_ID", "306783445")
-                existing_card_id = find_card_by_email(pipe_id, merged.email)
+                existing_card_id = _lookup_card(merged.email)
                 
                 if existing_card_id:
                     merged.interest_confirmed = None
@@ -422,8 +538,6 @@ def chat(body: ChatIn):
                 pass
         
         db.add(merged)
-        db.commit()
-        db.refresh(merged)
         
         has_all_required_data = (
             merged.name and 
@@ -432,18 +546,15 @@ def chat(body: ChatIn):
             merged.need
         )
         
-        if has_all_required_data and not _is_pipefy_card_id(session_id):
+        if has_all_required_data and not is_pipefy_card_id(session_id):
             try:
-                pipe_id = os.getenv("PIPEFY_PIPE_ID", "306783445")
-                existing_card_id = find_card_by_email(pipe_id, merged.email)
+                existing_card_id = _lookup_card(merged.email)
                 
                 if existing_card_id:
                     session_id = str(existing_card_id)
                     body.sessionId = session_id
                     merged.session_id = session_id
                     db.add(merged)
-                    db.commit()
-                    db.refresh(merged)
                 else:
                     fields_to_use = {
                         FIELD_NAMES["nome_do_lead"]: merged.name,
@@ -491,8 +602,6 @@ def chat(body: ChatIn):
                                 body.sessionId = session_id
                                 merged.session_id = session_id
                                 db.add(merged)
-                                db.commit()
-                                db.refresh(merged)
             except Exception:
                 pass
         
@@ -505,23 +614,21 @@ def chat(body: ChatIn):
                 original_lead.need = merged.need
                 original_lead.interest_confirmed = merged.interest_confirmed
                 db.add(original_lead)
-                db.commit()
         
-        if _is_pipefy_card_id(session_id):
-            has_data_to_sync = (
-                (merged.name and merged.name != "Aguardando coleta...") or
-                (merged.email and merged.email != "aguardando@coleta.com") or
-                (merged.company and merged.company != "Aguardando coleta...") or
-                (merged.need and merged.need != "Aguardando coleta...")
-            )
+        # Lead e card resolvidos: libera a transação antes do Cal.com (e da 2ª chamada ao LLM);
+        # as mensagens do turno vão no commit final
+        db.commit()
+        
+        if is_pipefy_card_id(session_id):
+            # Valores reais do lead (vazios e placeholders de coleta não vão para o Pipefy), avaliados uma vez
+            name_to_sync = _collected(merged.name, "Aguardando coleta...")
+            email_to_sync = _collected(merged.email, "aguardando@coleta.com")
+            company_to_sync = _collected(merged.company, "Aguardando coleta...")
+            need_to_sync = _collected(merged.need, "Aguardando coleta...")
             
-            if has_data_to_sync:
+            if name_to_sync or email_to_sync or company_to_sync or need_to_sync:
                 try:
-                    name_to_sync = merged.name if (merged.name and merged.name != "Aguardando coleta...") else None
-                    email_to_sync = merged.email if (merged.email and merged.email != "aguardando@coleta.com") else None
-                    company_to_sync = merged.company if (merged.company and merged.company != "Aguardando coleta...") else None
-                    need_to_sync = merged.need if (merged.need and merged.need != "Aguardando coleta...") else None
-                    interest_confirmed = merged.interest_confirmed if merged.interest_confirmed is not None else None
+                    interest_confirmed = merged.interest_confirmed
                     
                     no_interest_reason = None
                     if interest_confirmed is False:
@@ -545,7 +652,9 @@ def chat(body: ChatIn):
                     if interest_confirmed is False and not no_interest_reason:
                         no_interest_reason = "Não especificado pelo lead"
                     
-                    update_card_lead_fields(
+                    # Fora do caminho da resposta: o usuário não espera o round-trip ao Pipefy
+                    background_tasks.add_task(
+                        _sync_card_fields,
                         card_id=session_id,
                         name=name_to_sync,
                         email=email_to_sync,
@@ -561,33 +670,27 @@ def chat(body: ChatIn):
         offered_slots = (resp.get("action") or {}).get("type") == "OFFER_SLOTS"
 
         if want_slots and not offered_slots:
-            rs, re, alvo_h, modo, fallbacks = plan_windows(body.message)
-            slots = get_slots(rs, re)
-            slots = filter_slots_by_window(slots, rs, re)
-
-            if modo == "after" and alvo_h is not None:
-                slots = clamp_after_hour(slots, alvo_h)
+            # Data pedida: lida uma vez e reaproveitada nas janelas, nos fallbacks e no texto da oferta
+            if slot_plan is None:
+                base_brt, said_tomorrow = parse_date_pt(body.message)
+                slot_plan = (base_brt, said_tomorrow, plan_windows(body.message, (base_brt, said_tomorrow)))
+            base_brt, said_tomorrow, (rs, re, alvo_h, modo, fallbacks) = slot_plan
+            first_window = slots_prefetch.result() if slots_prefetch is not None else get_slots(rs, re)
+            slots = _select_slots(first_window, rs, re, alvo_h, modo)
 
             i = 0
             while not slots and i < len(fallbacks):
                 fs, fe = fallbacks[i]
-                slots = get_slots(fs, fe)
-                slots = filter_slots_by_window(slots, fs, fe)
-                if modo == "after" and alvo_h is not None:
-                    slots = clamp_after_hour(slots, alvo_h)
+                slots = _select_slots(get_slots(fs, fe), fs, fe, alvo_h, modo)
                 i += 1
 
-            slots = prioritize_slots(slots, alvo_h)
-            slots = slots[:5]
-
             if not slots:
-                base_brt, _ = parse_date_pt(body.message)
                 if base_brt.date() != _today_brt().date():
                     dia_inicio_utc = datetime.combine(base_brt.date(), time(0,0), tzinfo=BRT).astimezone(timezone.utc)
                     dia_fim_utc = datetime.combine(base_brt.date(), time(23,59,59), tzinfo=BRT).astimezone(timezone.utc)
                     alt_slots = get_slots(dia_inicio_utc, dia_fim_utc)
                     if alt_slots:
-                        alt_slots = [s for s in alt_slots if _to_brt(datetime.fromisoformat(s["start"].replace("Z", "+00:00"))).date() == base_brt.date()]
+                        alt_slots = [s for s in alt_slots if _slot_start_brt(s["start"]).date() == base_brt.date()]
                         if alt_slots:
                             alt_slots = sorted(alt_slots, key=lambda s: s.get("start", ""))[:5]
                             slots = alt_slots
@@ -605,18 +708,23 @@ def chat(body: ChatIn):
                 resp["reply"] = "Desculpe, não encontrei horários disponíveis no período solicitado. Você teria alguma outra preferência de dia e horário?"
                 resp["action"] = {"type": "ASK"}
             else:
-                base_brt, _ = parse_date_pt(body.message)
                 slots_date = None
                 if slots:
-                    first_slot_date = _to_brt(datetime.fromisoformat(slots[0]["start"].replace("Z", "+00:00"))).date()
+                    first_slot_date = _slot_start_brt(slots[0]["start"]).date()
                     slots_date = first_slot_date
                 
-                if modo == "after" and alvo_h is not None and slots_date == base_brt.date():
-                    prompt = f"O usuário pediu horários após as {alvo_h}h do dia {base_brt.strftime('%d/%m')}, mas só temos disponibilidade em outros horários do mesmo dia. Ofereça estes horários explicando que são do dia solicitado mas em horários diferentes, e pergunte se algum deles funciona."
-                else:
-                    prompt = "Ofereça estes horários para o usuário, no mesmo idioma."
+                after_sem_vaga = modo == "after" and alvo_h is not None and slots_date == base_brt.date()
                 
-                resp = llm.respond(build_state(slots=slots), prompt)
+                if settings.USE_LLM_FOR_SLOT_OFFER:
+                    if after_sem_vaga:
+                        prompt = f"O usuário pediu horários após as {alvo_h}h do dia {base_brt.strftime('%d/%m')}, mas só temos disponibilidade em outros horários do mesmo dia. Ofereça estes horários explicando que são do dia solicitado mas em horários diferentes, e pergunte se algum deles funciona."
+                    else:
+                        prompt = "Ofereça estes horários para o usuário, no mesmo idioma."
+                    resp = llm.respond(build_state(slots=slots), prompt)
+                else:
+                    # Texto determinístico: evita uma 2ª chamada ao LLM só para redigir a oferta
+                    intro = f"Não encontrei horários após as {alvo_h}h no dia {base_brt.strftime('%d/%m')}, mas nesse mesmo dia temos outras opções. " if after_sem_vaga else ""
+                    resp = {"reply": _slot_offer_text(slots, intro), "action": {"type": "OFFER_SLOTS"}}
                 act = resp.get("action") or {}
                 if not act.get("type"):
                     act["type"] = "OFFER_SLOTS"
@@ -628,10 +736,11 @@ def chat(body: ChatIn):
                     resp["reply"] = reply_text
 
         reply = resp.get("action", {}).get("reply") or resp.get("reply") or "Certo."
-        db.add(Message(session_id=session_id, role="assistant", content=reply))
+        db.add_all([user_message, Message(session_id=session_id, role="assistant", content=reply)])
         db.commit()
         
         if "sessionId" not in resp:
             resp["sessionId"] = session_id
         
-        return resp
+        # Resposta já é JSON puro (saída do LLM + slots): JSONResponse direto evita o jsonable_encoder do FastAPI
+        return JSONResponse(resp)
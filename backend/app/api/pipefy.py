@@ -1,12 +1,34 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
-import httpx
-from datetime import datetime
+import re
+import logging
+from datetime import date
 
+from app.api.chat import chat, ChatIn
 from app.core.pipefy import update_card_booking, PHASE_AGENDADO_ID
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Validação de formato sem strptime (mesmos formatos aceitos por "%Y-%m-%d" / "%H:%M")
+_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+_TIME_RE = re.compile(r"(\d{1,2}):(\d{1,2})")
+
+def _is_valid_date(s: str) -> bool:
+    m = _DATE_RE.fullmatch(s)
+    if not m:
+        return False
+    try:
+        date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        return True
+    except ValueError:
+        return False
+
+def _is_valid_time(s: str) -> bool:
+    m = _TIME_RE.fullmatch(s)
+    return bool(m) and int(m.group(1)) < 24 and int(m.group(2)) < 60
 
 # -----------------------------------------------------------------------------
 # Modelos de entrada
@@ -30,10 +52,10 @@ class UpdateBookingIn(BaseModel):
 # -----------------------------------------------------------------------------
 
 @router.post("/pipefy/webhook")
-async def pipefy_webhook(payload: dict):
+async def pipefy_webhook(payload: dict, background_tasks: BackgroundTasks):
     """
     Recebe webhook do Pipefy quando um card é criado.
-    Extrai dados do lead e dispara o fluxo SDR via /api/chat.
+    Dispara o fluxo SDR (chat) em background, no próprio processo, e responde na hora.
     """
     
     try:
@@ -41,87 +63,15 @@ async def pipefy_webhook(payload: dict):
         # O formato pode variar, então tentamos diferentes estruturas
         card_data = payload.get("card") or payload.get("data", {}).get("card") or payload.get("data") or {}
         
-        # Extrai campos do card (pode vir em fields ou diretamente)
-        fields = card_data.get("fields", [])
-        field_map = {}
-        
-        # Converte array de fields em dict para facilitar acesso
-        if isinstance(fields, list):
-            for field in fields:
-                field_id = field.get("field", {}).get("id") or field.get("id")
-                field_value = field.get("value") or field.get("field_value", {}).get("value")
-                if field_id and field_value:
-                    field_map[field_id] = field_value
-        elif isinstance(fields, dict):
-            field_map = fields
-        
-        # Extrai valores dos campos conhecidos
-        # Tenta pelos IDs/labels: nome_do_lead, email_do_lead, empresa_do_lead, necessidade_do_lead
-        name = (
-            field_map.get("nome_do_lead") or
-            field_map.get("name") or
-            card_data.get("title") or
-            ""
-        )
-        email = (
-            field_map.get("email_do_lead") or
-            field_map.get("email") or
-            ""
-        )
-        company = (
-            field_map.get("empresa_do_lead") or
-            field_map.get("company") or
-            field_map.get("empresa") or
-            ""
-        )
-        need = (
-            field_map.get("necessidade_do_lead") or
-            field_map.get("need") or
-            field_map.get("necessidade") or
-            ""
-        )
-        
         # Card ID é usado como sessionId
         card_id = card_data.get("id") or payload.get("card_id") or payload.get("id")
         
         if not card_id:
             raise HTTPException(status_code=400, detail="card_id não encontrado no payload")
         
-        
-        # Prepara payload para /api/chat
-        chat_payload = {
-            "sessionId": str(card_id),
-            "message": "Novo lead do Pipefy",
-            "lead": {
-                "name": name if name else None,
-                "email": email if email else None,
-                "company": company if company else None,
-                "need": need if need else None,
-            }
-        }
-        
-        # Chama /api/chat internamente
-        # Nota: Em produção, você pode querer fazer isso de forma assíncrona
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # URL base do backend (pode ser configurada via env var)
-                import os
-                # No Vercel, usa a URL do próprio deployment
-                base_url = os.getenv("API_BASE_URL") or os.getenv("VERCEL_URL", "http://localhost:8000")
-                if base_url and not base_url.startswith("http"):
-                    base_url = f"https://{base_url}"
-                response = await client.post(
-                    f"{base_url}/api/chat",
-                    json=chat_payload
-                )
-                response.raise_for_status()
-                chat_result = response.json()
-        except Exception as e:
-            # Não falha o webhook se o chat falhar
-            raise HTTPException(
-                status_code=502,
-                detail=f"Erro ao iniciar chat: {str(e)}"
-            )
+        # Chama o handler do chat direto (sem HTTP para o próprio deployment);
+        # o webhook não espera o turno do LLM
+        background_tasks.add_task(_start_chat, str(card_id))
         
         return {
             "ok": True,
@@ -134,6 +84,15 @@ async def pipefy_webhook(payload: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao processar webhook: {str(e)}")
 
+async def _start_chat(card_id: str) -> None:
+    """Roda o primeiro turno do chat para o card (handler síncrono vai para o threadpool)."""
+    try:
+        tasks = BackgroundTasks()
+        await run_in_threadpool(chat, ChatIn(sessionId=card_id, message="Novo lead do Pipefy"), tasks)
+        await tasks()
+    except Exception as e:
+        logger.warning("[PIPEFY] Erro ao iniciar chat para o card %s: %s: %s", card_id, type(e).__name__, e)
+
 @router.post("/pipefy/updateBooking")
 def update_booking(body: UpdateBookingIn):
     """
@@ -142,15 +101,11 @@ def update_booking(body: UpdateBookingIn):
     """
     try:
         # Valida formato de data
-        try:
-            datetime.strptime(body.date, "%Y-%m-%d")
-        except ValueError:
+        if not _is_valid_date(body.date):
             raise HTTPException(status_code=400, detail="Formato de data inválido. Use YYYY-MM-DD")
         
         # Valida formato de hora
-        try:
-            datetime.strptime(body.time, "%H:%M")
-        except ValueError:
+        if not _is_valid_time(body.time):
             raise HTTPException(status_code=400, detail="Formato de hora inválido. Use HH:MM")
         
         # Atualiza card no Pipefy
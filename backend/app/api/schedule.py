@@ -1,17 +1,24 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timezone
 from dateutil import parser as dtparser  # pip install python-dateutil
 from sqlmodel import select
-import httpx
-import os
+import logging
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # py<3.9
+    from backports.zoneinfo import ZoneInfo  # type: ignore
 
 from app.core.calendar import get_slots, schedule_slot, cancel_booking
-from app.models.db import get_session, Meeting, get_lead_by_session, Lead, Message
-from app.core.pipefy import find_card_by_title, find_card_by_email
+from app.models.db import get_session, Meeting, get_lead_by_session, Lead
+from app.core.pipefy import find_card_by_title, find_card_by_email, update_card_booking, is_pipefy_card_id, PIPEFY_PIPE_ID
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+BRT = ZoneInfo("America/Sao_Paulo")
 
 class ScheduleIn(BaseModel):
     slotId: str
@@ -27,16 +34,113 @@ class CancelIn(BaseModel):
     reason: Optional[str] = None
 
 def _parse_iso(s: Optional[str]) -> Optional[datetime]:
-    if not s:
+    # Rejeita cedo o que é curto demais para uma data ISO completa: a menor é a compacta
+    # YYYYMMDD / semana YYYY-Www (8 caracteres); formas reduzidas como YYYY-MM ficam de fora
+    if not s or len(s) < 8:
         return None
     try:
-        d = dtparser.isoparse(s)
+        # fromisoformat (C) cobre o formato usual; dateutil fica de fallback para variantes ISO menos comuns
+        try:
+            d = datetime.fromisoformat(s[:-1] + "+00:00" if s.endswith("Z") else s)
+        except ValueError:
+            d = dtparser.isoparse(s)
+        # Strings com Z/offset já vêm aware; só as naive ganham UTC
         if d.tzinfo is None:
             d = d.replace(tzinfo=timezone.utc)
         return d
     except Exception:
         return None
 
+def _parse_calcom_iso(s: str) -> Optional[datetime]:
+    """
+    Parser dedicado ao formato que o Cal.com devolve em "start" (ex: 2024-05-14T15:00:00.000Z).
+    Qualquer outro formato (mock, offsets) cai no _parse_iso genérico.
+    """
+    if len(s) >= 20 and s[-1] == "Z" and s[10] == "T":
+        try:
+            return datetime(
+                int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                tzinfo=timezone.utc,
+            )
+        except ValueError:
+            pass
+    return _parse_iso(s)
+
+def _resolve_card_id(session_id: str, lead_email: Optional[str]) -> Optional[str]:
+    """Descobre o card_id do Pipefy da sessão (ela mesma, banco local, Pipefy por email ou por título)."""
+    if is_pipefy_card_id(session_id):
+        return session_id
+    
+    pipe_id = PIPEFY_PIPE_ID
+    has_email = bool(lead_email) and "@" in lead_email
+    
+    # PRIORIDADE 1: Busca no banco de dados por um lead com card_id que tenha o mesmo email
+    # Isso é mais confiável porque o email é único (só a coluna session_id, usando o índice de email)
+    if has_email:
+        with get_session() as db:
+            stmt = select(Lead.session_id).where(
+                (Lead.email == lead_email) &
+                (Lead.session_id != session_id)
+            )
+            found_card_id = next((sid for sid in db.exec(stmt) if is_pipefy_card_id(sid)), None)
+        if found_card_id:
+            return found_card_id
+    
+    # Só vai ao Pipefy (rede) se o banco não respondeu
+    # PRIORIDADE 2: busca no Pipefy por email (mais confiável que título)
+    if has_email:
+        found_card_id = find_card_by_email(pipe_id, lead_email)
+        if found_card_id:
+            return found_card_id
+    
+    # PRIORIDADE 3: Se não encontrou por email, busca no Pipefy pelo título (UUID)
+    return find_card_by_title(pipe_id, session_id[:20])
+
+def _post_schedule_hook(session_id: str, lead_email: Optional[str], result: dict) -> None:
+    """
+    Preenche os campos de reunião no card e move para "Agendado".
+    Roda como BackgroundTask: a resposta do /schedule não espera busca de card nem Pipefy.
+    """
+    try:
+        card_id = _resolve_card_id(session_id, lead_email)
+    except Exception as e:
+        # Continua sem atualizar Pipefy se não conseguir encontrar o card_id
+        logger.warning("[SCHEDULE] Erro ao buscar card do Pipefy (sessão %s): %s", session_id, e)
+        card_id = session_id
+    if not card_id:
+        return
+    
+    # Parse da data/hora do meeting
+    meeting_dt = _parse_calcom_iso(result["meetingDatetime"])
+    if not meeting_dt:
+        return
+    # Converte para timezone local (BRT) para exibição
+    meeting_brt = meeting_dt.astimezone(BRT)
+    
+    try:
+        update_card_booking(
+            card_id=card_id,
+            # Formatos fixos: isoformat/f-string evitam o strftime
+            meeting_date=meeting_brt.date().isoformat(),
+            meeting_time=f"{meeting_brt.hour:02d}:{meeting_brt.minute:02d}",
+            meeting_location=result["meetingLink"],
+            phase_id=None,
+        )
+    except Exception as e:
+        # Não falha o agendamento se o Pipefy falhar
+        logger.warning("[SCHEDULE] Erro ao atualizar agendamento no Pipefy (card %s): %s", card_id, e)
+
+def _cancel_response(status: str, meeting: Meeting) -> dict:
+    canceled_at = meeting.canceled_at
+    return {
+        "status": status,
+        "meetingId": meeting.id,
+        "bookingId": meeting.booking_id,
+        "canceledAt": canceled_at.isoformat() if canceled_at else None,
+        "reason": meeting.cancel_reason,
+    }
+
 @router.get("/slots")
 def slots(
     sessionId: str = Query(...),
@@ -48,7 +152,7 @@ def slots(
     return {"slots": get_slots(start_dt, end_dt)}
 
 @router.post("/schedule")
-def schedule(body: ScheduleIn):
+def schedule(body: ScheduleIn, background_tasks: BackgroundTasks):
     with get_session() as db:
         # Busca o lead para usar nome e email se não foram fornecidos
         lead = get_lead_by_session(db, body.sessionId)
@@ -76,98 +180,13 @@ def schedule(body: ScheduleIn):
             datetime_iso=result["meetingDatetime"],
             booking_id=result.get("bookingId"),
         )
+        # Lido antes do commit (depois dele os atributos expiram)
+        lead_email = lead.email
         db.add(meeting)
         db.commit()
-        
-        # Atualiza card no Pipefy se sessionId for um card_id do Pipefy
-        # Primeiro, tenta encontrar o card_id do Pipefy se sessionId for um UUID
-        pipefy_card_id = body.sessionId
-        
-        def _is_pipefy_card_id(session_id: str) -> bool:
-            """Verifica se sessionId parece ser um card_id do Pipefy."""
-            if not session_id:
-                return False
-            return session_id.isdigit() and len(session_id) >= 6
-        
-        if not _is_pipefy_card_id(pipefy_card_id):
-            # Se não é um card_id, tenta encontrar o card_id correspondente
-            try:
-                pipe_id = os.getenv("PIPEFY_PIPE_ID", "306783445")
-                found_card_id = None
-                
-                # PRIORIDADE 1: Busca no banco de dados por um lead com card_id que tenha o mesmo email
-                # Isso é mais confiável porque o email é único
-                if lead.email and "@" in lead.email:
-                    stmt = select(Lead).where(
-                        (Lead.email == lead.email) &
-                        (Lead.session_id != body.sessionId)
-                    )
-                    matching_leads = db.exec(stmt).all()
-                    for matching_lead in matching_leads:
-                        if _is_pipefy_card_id(matching_lead.session_id):
-                            found_card_id = matching_lead.session_id
-                            break
-                
-                # PRIORIDADE 2: Se não encontrou no DB, busca no Pipefy por email (mais confiável que título)
-                if not found_card_id and lead.email and "@" in lead.email:
-                    found_card_id = find_card_by_email(pipe_id, lead.email)
-                
-                # PRIORIDADE 3: Se não encontrou por email, busca no Pipefy pelo título (UUID)
-                if not found_card_id:
-                    found_card_id = find_card_by_title(pipe_id, body.sessionId[:20])
-                
-                # PRIORIDADE 4: Busca no banco de dados por qualquer lead com card_id relacionado ao UUID
-                # Verifica se há mensagens ou meetings com o UUID que possam indicar o card_id
-                if not found_card_id:
-                    # Busca mensagens com o UUID para encontrar o card_id relacionado
-                    stmt = select(Message).where(Message.session_id == body.sessionId).limit(1)
-                    message = db.exec(stmt).first()
-                    if message:
-                        # Se há mensagens, busca por leads que possam estar relacionados
-                        # Busca por qualquer lead com card_id que tenha sido criado recentemente
-                        stmt = select(Lead).where(
-                            (Lead.session_id != body.sessionId) &
-                            (Lead.email.isnot(None))
-                        )
-                        # Tenta encontrar um lead que possa estar relacionado
-                        # (esta é uma busca menos precisa, mas pode ajudar)
-                        pass  # Esta busca é muito ampla, vamos pular
-                
-                if found_card_id:
-                    pipefy_card_id = found_card_id
-                else:
-                    return result
-            except Exception:
-                # Continua sem atualizar Pipefy se não conseguir encontrar o card_id
-                pass
-        
-        try:
-            # Parse da data/hora do meeting
-            meeting_dt = _parse_iso(result["meetingDatetime"])
-            if meeting_dt:
-                # Converte para timezone local (BRT) para exibição
-                from zoneinfo import ZoneInfo
-                BRT = ZoneInfo("America/Sao_Paulo")
-                meeting_brt = meeting_dt.astimezone(BRT)
-                
-                meeting_date = meeting_brt.strftime("%Y-%m-%d")
-                meeting_time = meeting_brt.strftime("%H:%M")
-                
-                # Atualiza Pipefy diretamente (sem chamada HTTP interna)
-                try:
-                    from app.core.pipefy import update_card_booking
-                    update_card_booking(
-                        card_id=pipefy_card_id,
-                        meeting_date=meeting_date,
-                        meeting_time=meeting_time,
-                        meeting_location=result["meetingLink"],
-                        phase_id=None,
-                    )
-                except Exception:
-                            # Não falha o agendamento se o Pipefy falhar
-                    pass
-        except Exception:
-            pass
+    
+    # Atualiza card no Pipefy depois da resposta (resolve o card_id lá também)
+    background_tasks.add_task(_post_schedule_hook, body.sessionId, lead_email, result)
     
     return result
 
@@ -182,7 +201,7 @@ def cancel(body: CancelIn):
             meeting = db.get(Meeting, body.meetingId)
 
         if meeting is None and body.bookingId:
-            stmt = select(Meeting).where(Meeting.booking_id == body.bookingId)
+            stmt = select(Meeting).where(Meeting.booking_id == body.bookingId).limit(1)
             meeting = db.exec(stmt).first()
 
         if meeting is None:
@@ -190,33 +209,24 @@ def cancel(body: CancelIn):
 
         # Idempotência
         if meeting.canceled_at is not None:
-            return {
-                "status": "already_canceled",
-                "meetingId": meeting.id,
-                "bookingId": meeting.booking_id,
-                "canceledAt": meeting.canceled_at.isoformat() if meeting.canceled_at else None,
-                "reason": meeting.cancel_reason,
-            }
+            return _cancel_response("already_canceled", meeting)
 
         # Cancela no Cal.com (se tiver booking_id)
         if meeting.booking_id:
             try:
                 cancel_booking(meeting.booking_id, reason=body.reason)
-            except Exception:
+            except Exception as e:
                 # Não bloqueia o cancelamento local se o Cal.com falhar
-                pass
+                logger.warning("[SCHEDULE] Erro ao cancelar booking %s no Cal.com: %s", meeting.booking_id, e)
 
-        # Marca cancelamento local
-        meeting.canceled_at = datetime.utcnow()
+        # Marca cancelamento local (meeting já está na sessão)
+        # UTC naive, como as demais colunas de data do banco (utcnow está depreciado no 3.12)
+        meeting.canceled_at = datetime.now(timezone.utc).replace(tzinfo=None)
         meeting.cancel_reason = body.reason
-        db.add(meeting)
+
+        # Monta a resposta antes do commit: depois dele os atributos expiram e
+        # lê-los custaria um SELECT extra
+        response = _cancel_response("canceled", meeting)
         db.commit()
-        db.refresh(meeting)
-
-        return {
-            "status": "canceled",
-            "meetingId": meeting.id,
-            "bookingId": meeting.booking_id,
-            "canceledAt": meeting.canceled_at.isoformat() if meeting.canceled_at else None,
-            "reason": meeting.cancel_reason,
-        }
+
+        return response
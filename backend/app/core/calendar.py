@@ -1,24 +1,62 @@
-import os
+import re
+import time
+import atexit
+import threading
 import datetime as dt
-from typing import List, Dict, Optional, Any
+from functools import lru_cache
+from typing import List, Dict, Optional, Any, Tuple
 import httpx
 
-MOCK = os.getenv("MOCK_EXTERNALS", "true").lower() == "true"
-TIMEZONE = os.getenv("TIMEZONE", "America/Sao_Paulo")
+from app.core.config import settings
+
+# Lidos uma vez em config.settings (mesmos defaults em todo o app)
+MOCK = settings.MOCK_EXTERNALS
+TIMEZONE = settings.TIMEZONE
+
+def _normalize_tz(raw: Optional[str]) -> str:
+    # Cal.com espera timezone IANA válido (ex: "America/Sao_Paulo" ou "UTC")
+    # Garante que não está vindo com ":" ou outros caracteres inválidos
+    tz = raw.strip() if raw else "UTC"
+    if tz.startswith(":"):
+        tz = tz[1:]  # Remove ":" se presente
+    if not tz or tz == ":":
+        tz = "UTC"
+    return tz
+
+# Timezone enviada ao Cal.com: constante do processo, normalizada uma vez
+_TIMEZONE_IANA = _normalize_tz(TIMEZONE)
 
 CAL_BASE = "https://api.cal.com"
-CAL_API_KEY = os.getenv("CAL_API_KEY")
-CAL_USERNAME = os.getenv("CAL_USERNAME")                 # ex: "leo-mosca-loncarovich"
-CAL_EVENT_TYPE_SLUG = os.getenv("CAL_EVENT_TYPE_SLUG")   # ex: "30min"
-CAL_EVENT_TYPE_ID = os.getenv("CAL_EVENT_TYPE_ID")       # ex: "3830730"
+CAL_API_KEY = settings.CAL_API_KEY
+CAL_USERNAME = settings.CAL_USERNAME
+CAL_EVENT_TYPE_SLUG = settings.CAL_EVENT_TYPE_SLUG
+CAL_EVENT_TYPE_ID = settings.CAL_EVENT_TYPE_ID
+# eventTypeId numérico, convertido uma vez (None se ausente/inválido -> usa slug + username)
+try:
+    _CAL_EVENT_TYPE_ID: Optional[int] = int(CAL_EVENT_TYPE_ID) if CAL_EVENT_TYPE_ID else None
+except ValueError:
+    _CAL_EVENT_TYPE_ID = None
 # Mantemos CAL_API_VERSION para slots/availability; bookings sempre usarão 2024-08-13
-CAL_API_VERSION = os.getenv("CAL_API_VERSION", "2024-09-04")
+CAL_API_VERSION = settings.CAL_API_VERSION
+
+# Cache de slots do Cal.com: a API só recebe datas, então janelas diferentes no mesmo dia
+# (janela pedida, fallbacks, dia inteiro) e usuários perguntando pelo mesmo dia reaproveitam a resposta.
+# Chave: (data_inicio, data_fim). Valor: (slots, expira_em). Limpo ao agendar/cancelar.
+_SLOTS_CACHE: Dict[Tuple[str, str], Tuple[List[Dict], float]] = {}
+_SLOTS_CACHE_MAX = 256
+_SLOTS_TTL = 30.0
+# get_slots roda em threads do threadpool/prefetch: inserção, despejo e limpeza sob o mesmo lock
+_SLOTS_CACHE_LOCK = threading.Lock()
 
 # ---------- Helpers ----------
 def _iso(d: dt.datetime) -> str:
     if d.tzinfo is None:
         d = d.replace(tzinfo=dt.timezone.utc)
-    return d.isoformat()
+    out = d.isoformat()
+    # UTC sai com "Z" (mesmo formato do Cal.com), que os parsers de slot leem pelo caminho rápido
+    if out.endswith("+00:00"):
+        return out[:-6] + "Z"
+    return out
 
 def _tomorrow_range_local(start_h=9, end_h=18, tz=dt.timezone.utc) -> tuple[dt.datetime, dt.datetime]:
     now = dt.datetime.now(tz)
@@ -34,36 +72,50 @@ def _headers(required_version: str) -> Dict[str, str]:
         "cal-api-version": required_version,
     }
 
+# Cliente compartilhado: reaproveita as conexões (TLS) com api.cal.com entre chamadas
+_HTTP = httpx.Client(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+atexit.register(_HTTP.close)  # vive o processo inteiro; fecha as conexões na saída
+
 # ---------- MOCK ----------
-def mock_slots(preferred_start: Optional[dt.datetime], preferred_end: Optional[dt.datetime]) -> List[Dict]:
-    now = dt.datetime.now(dt.timezone.utc)
-    base_date = (preferred_start.date() if preferred_start else (now + dt.timedelta(days=1)).date())
-    if preferred_start and preferred_start < now:
-        base_date = (now + dt.timedelta(days=1)).date()
+@lru_cache(maxsize=32)
+def _mock_grid_for_date(base_date: dt.date) -> Tuple[Tuple[Dict, dt.datetime], ...]:
+    """Grade de slots mock do dia: (slot, início) — o datetime fica junto para o filtro não reparsear a string."""
     base = dt.datetime.combine(base_date, dt.time(12, 0, 0), tzinfo=dt.timezone.utc)  # 12:00Z ≈ 09:00 BRT
     raw = []
     for i in range(16):  # 09:00–16:30 BRT em passos de 30min
         s = base + dt.timedelta(minutes=30 * i)
         e = s + dt.timedelta(minutes=30)
-        raw.append({"id": f"mock-{int(s.timestamp())}", "start": _iso(s), "end": _iso(e)})
+        raw.append(({"id": f"mock-{int(s.timestamp())}", "start": _iso(s), "end": _iso(e)}, s))
+    return tuple(raw)
+
+def mock_slots(preferred_start: Optional[dt.datetime], preferred_end: Optional[dt.datetime]) -> List[Dict]:
+    now = dt.datetime.now(dt.timezone.utc)
+    base_date = (preferred_start.date() if preferred_start else (now + dt.timedelta(days=1)).date())
+    if preferred_start and preferred_start < now:
+        base_date = (now + dt.timedelta(days=1)).date()
+    raw = _mock_grid_for_date(base_date)
 
+    # Cópias rasas: a grade em cache é compartilhada entre chamadas
     if preferred_start and preferred_end:
-        filtered = []
-        for r in raw:
-            slot_start = dt.datetime.fromisoformat(r["start"].replace("Z", "+00:00"))
-            if preferred_start <= slot_start <= preferred_end:
-                filtered.append(r)
+        filtered = [dict(r) for r, sdt in raw if preferred_start <= sdt <= preferred_end]
         if filtered:
             return filtered[:16]
-        return [r for r in raw if dt.datetime.fromisoformat(r["start"].replace("Z", "+00:00")).date() == base_date][:16]
+        return [dict(r) for r, sdt in raw if sdt.date() == base_date][:16]
+
+    return [dict(r) for r, _ in raw[:16]]
 
-    return raw[:16]
+# Timestamp no último segmento do id (ex: "mock-1731592800")
+_MOCK_TS_RE = re.compile(r"(?:^|-)(\d+)$")
 
 def mock_schedule(slot_id: str) -> Dict:
-    ts = slot_id.split("-")[-1]
-    try:
-        start = dt.datetime.utcfromtimestamp(int(ts)).replace(tzinfo=dt.timezone.utc)
-    except Exception:
+    start = None
+    m = _MOCK_TS_RE.search(slot_id)
+    if m:
+        try:
+            start = dt.datetime.fromtimestamp(int(m.group(1)), tz=dt.timezone.utc)
+        except (OverflowError, OSError, ValueError):  # timestamp fora do intervalo suportado
+            pass
+    if start is None:
         start = dt.datetime.now(dt.timezone.utc) + dt.timedelta(days=1, hours=12)
     return {
         "meetingLink": f"https://meet.example/{slot_id}",
@@ -82,48 +134,63 @@ def get_slots(preferred_start: Optional[dt.datetime], preferred_end: Optional[dt
     if not (preferred_start and preferred_end):
         preferred_start, preferred_end = _tomorrow_range_local(9, 18, tz=dt.timezone.utc)
 
-    # Cal.com espera timezone IANA válido (ex: "America/Sao_Paulo" ou "UTC")
-    # Garante que não está vindo com ":" ou outros caracteres inválidos
-    timezone_value = TIMEZONE.strip() if TIMEZONE else "UTC"
-    if timezone_value.startswith(":"):
-        timezone_value = timezone_value[1:]  # Remove ":" se presente
-    if not timezone_value or timezone_value == ":":
-        timezone_value = "UTC"
-    
+    start_date = preferred_start.date().isoformat()
+    end_date = preferred_end.date().isoformat()
+    cache_key = (start_date, end_date)
+    cached = _SLOTS_CACHE.get(cache_key)
+    if cached and cached[1] > time.monotonic():
+        return list(cached[0])
+
     params = {
         "eventTypeSlug": CAL_EVENT_TYPE_SLUG,
         "username": CAL_USERNAME,
-        "start": preferred_start.date().isoformat(),
-        "end": preferred_end.date().isoformat(),
-        "timeZone": timezone_value,
+        "start": start_date,
+        "end": end_date,
+        "timeZone": _TIMEZONE_IANA,
         "format": "range",
     }
 
     # slots usam 2024-09-04
     url = f"{CAL_BASE}/v2/slots"
     try:
-        with httpx.Client(timeout=12.0) as client:
-            r = client.get(url, headers=_headers("2024-09-04"), params=params)
-            if r.status_code != 200:
-                r.raise_for_status()
-            r.raise_for_status()
-            data = r.json()
+        r = _HTTP.get(url, headers=_headers("2024-09-04"), params=params, timeout=12.0)
+        r.raise_for_status()
+        data = r.json()
 
         days = (data.get("data") or {})
-        out: List[Dict] = []
-        for _, slots_list in days.items():
-            if not isinstance(slots_list, list):
-                continue
-            for ts in slots_list:
-                s = ts.get("start") if isinstance(ts, dict) else None
-                e = ts.get("end") if isinstance(ts, dict) else None
-                if s:
-                    out.append({"id": f"cal-{len(out)}-{s}", "start": s, "end": e or s})
-        return out if out else mock_slots(preferred_start, preferred_end)
+        valid = [
+            ts
+            for slots_list in days.values() if isinstance(slots_list, list)
+            for ts in slots_list if isinstance(ts, dict) and ts.get("start")
+        ]
+        out: List[Dict] = [
+            {"id": f"cal-{i}-{ts['start']}", "start": ts["start"], "end": ts.get("end") or ts["start"]}
+            for i, ts in enumerate(valid)
+        ]
+        if not out:
+            return mock_slots(preferred_start, preferred_end)
+
+        _remember_slots(cache_key, out)
+        return list(out)
 
     except Exception:
         return mock_slots(preferred_start, preferred_end)
 
+def _remember_slots(cache_key: Tuple[str, str], out: List[Dict]) -> None:
+    now = time.monotonic()
+    with _SLOTS_CACHE_LOCK:
+        if len(_SLOTS_CACHE) >= _SLOTS_CACHE_MAX:
+            # Cheio: descarta primeiro o que já expirou, depois o mais antigo
+            for k in [k for k, v in _SLOTS_CACHE.items() if v[1] <= now]:
+                del _SLOTS_CACHE[k]
+            if len(_SLOTS_CACHE) >= _SLOTS_CACHE_MAX:
+                del _SLOTS_CACHE[next(iter(_SLOTS_CACHE))]
+        _SLOTS_CACHE[cache_key] = (out, now + _SLOTS_TTL)
+
+def _clear_slots_cache() -> None:
+    with _SLOTS_CACHE_LOCK:
+        _SLOTS_CACHE.clear()
+
 def _ensure_utc_z(iso_str: Optional[str]) -> Optional[str]:
     if not iso_str:
         return None
@@ -131,13 +198,17 @@ def _ensure_utc_z(iso_str: Optional[str]) -> Optional[str]:
     s = iso_str
     if s.endswith("Z"):
         return s
+    # UTC com offset explícito ("YYYY-MM-DDTHH:MM:SS+00:00") -> só troca o sufixo, sem parsear
+    if len(s) == 25 and s.endswith("+00:00"):
+        return s[:19] + "Z"
     try:
         s = s.replace("Z", "+00:00")
         if "+" in s or "-" in s[-6:]:
             dt_obj = dt.datetime.fromisoformat(s)
         else:
             dt_obj = dt.datetime.fromisoformat(s + "+00:00")
-        return dt_obj.astimezone(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        utc = dt_obj.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        return utc.isoformat(timespec="seconds") + "Z"
     except Exception:
         return iso_str  # deixa como veio
 
@@ -154,12 +225,10 @@ def cancel_booking(booking_id: str, reason: Optional[str] = None) -> Dict:
     body = {"reason": reason} if reason else {}
 
     try:
-        with httpx.Client(timeout=20.0) as client:
-            r = client.post(url, headers=headers, json=body)
-            if r.status_code not in (200, 204, 202):
-                r.raise_for_status()
-            r.raise_for_status()
-            return r.json() if r.text else {"status": "ok"}
+        r = _HTTP.post(url, headers=headers, json=body, timeout=20.0)
+        r.raise_for_status()
+        _clear_slots_cache()  # horário liberado
+        return r.json() if r.text else {"status": "ok"}
     except Exception as e:
         raise RuntimeError(f"Erro ao cancelar no Cal.com: {type(e).__name__}: {e}")
 
@@ -182,44 +251,30 @@ def schedule_slot(
     if not start_utc:
         return mock_schedule(slot_id)
 
-    # Cal.com espera timezone IANA válido (ex: "America/Sao_Paulo" ou "UTC")
-    # Garante que não está vindo com ":" ou outros caracteres inválidos
-    timezone_value = TIMEZONE.strip() if TIMEZONE else "UTC"
-    if timezone_value.startswith(":"):
-        timezone_value = timezone_value[1:]  # Remove ":" se presente
-    if not timezone_value or timezone_value == ":":
-        timezone_value = "UTC"
-
     body: Dict[str, Any] = {
         "start": start_utc,   # apenas start; NÃO enviar 'end'
         "attendee": {
             "name": attendee_name or "Convidado",
             "email": attendee_email or "lead@example.com",
-            "timeZone": timezone_value,
+            "timeZone": _TIMEZONE_IANA,
             "language": "pt-BR",
         },
         "metadata": {"source": "ai-sdr"},
     }
 
-    if CAL_EVENT_TYPE_ID:
-        try:
-            body["eventTypeId"] = int(CAL_EVENT_TYPE_ID)
-        except ValueError:
-            body["eventTypeSlug"] = CAL_EVENT_TYPE_SLUG
-            body["username"] = CAL_USERNAME
+    if _CAL_EVENT_TYPE_ID is not None:
+        body["eventTypeId"] = _CAL_EVENT_TYPE_ID
     else:
         body["eventTypeSlug"] = CAL_EVENT_TYPE_SLUG
         body["username"] = CAL_USERNAME
 
     url = f"{CAL_BASE}/v2/bookings"
     try:
-        with httpx.Client(timeout=20.0) as client:
-            r = client.post(url, headers=headers, json=body)
-            if r.status_code not in (200, 201):
-                r.raise_for_status()
-            r.raise_for_status()
-            data = r.json()
+        r = _HTTP.post(url, headers=headers, json=body, timeout=20.0)
+        r.raise_for_status()
+        data = r.json()
 
+        _clear_slots_cache()  # horário ocupado
         payload = data.get("data") or data
         booking = payload.get("booking") or payload
 
@@ -1,6 +1,13 @@
 import os
-from dotenv import load_dotenv
-load_dotenv()
+
+# .env é só para desenvolvimento local; em produção as variáveis vêm do ambiente
+# e LOAD_DOTENV=0 evita a busca pelo arquivo no cold start
+if os.getenv("LOAD_DOTENV", "1") == "1":
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
 
 class Settings:
     DB_URL: str = os.getenv("DB_URL", "sqlite:///./data.db")
@@ -8,10 +15,17 @@ class Settings:
     GEMINI_API_KEY: str | None = os.getenv("GEMINI_API_KEY")
     CAL_API_KEY: str | None = os.getenv("CAL_API_KEY")
     CAL_CALENDAR_ID: str | None = os.getenv("CAL_CALENDAR_ID")
+    CAL_USERNAME: str | None = os.getenv("CAL_USERNAME")                 # ex: "leo-mosca-loncarovich"
+    CAL_EVENT_TYPE_SLUG: str | None = os.getenv("CAL_EVENT_TYPE_SLUG")   # ex: "30min"
+    CAL_EVENT_TYPE_ID: str | None = os.getenv("CAL_EVENT_TYPE_ID")       # ex: "3830730"
+    CAL_API_VERSION: str = os.getenv("CAL_API_VERSION", "2024-09-04")
+    TIMEZONE: str = os.getenv("TIMEZONE", "America/Sao_Paulo")
     PIPEFY_API_TOKEN: str | None = os.getenv("PIPEFY_API_TOKEN")
     PIPEFY_PIPE_ID: str | None = os.getenv("PIPEFY_PIPE_ID")
     PIPEFY_STAGE_ID_PREVENDAS: str | None = os.getenv("PIPEFY_STAGE_ID_PREVENDAS")
     # Timeout de sessão em horas (deve ser definido no .env, padrão recomendado: 2)
     SESSION_TTL_HOURS: int = int(os.getenv("SESSION_TTL_HOURS", "2"))
+    # Se true, a oferta de horários é redigida pelo LLM (2ª chamada); senão usa texto montado no servidor
+    USE_LLM_FOR_SLOT_OFFER: bool = os.getenv("USE_LLM_FOR_SLOT_OFFER", "false").lower() == "true"
 
 settings = Settings()
@@ -1,24 +1,80 @@
-from typing import Dict
+from typing import Dict, Optional, Tuple
 import json
-import os
+import re
+import time
+import logging
+import threading
 
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
+from app.core.config import settings
 
-API_KEY = os.getenv("GEMINI_API_KEY")
+logger = logging.getLogger(__name__)
+
+API_KEY = settings.GEMINI_API_KEY
 MODEL_NAME = "gemini-2.5-flash"
 
+# O SDK do Gemini (grpc/protobuf) é pesado de importar: só é carregado no primeiro respond(),
+# e não no cold start de rotas que não usam o LLM
 model = None
-if genai and API_KEY:
-    # Força a saída em JSON
-    model = genai.GenerativeModel(
-        MODEL_NAME,
-        generation_config={
-            "response_mime_type": "application/json",
-        }
-    )
+_model_loaded = False
+# Requisições simultâneas no cold start esperam o carregamento em vez de cair no _safe_default
+_MODEL_LOCK = threading.Lock()
+
+def _get_model():
+    global model, _model_loaded
+    if _model_loaded:
+        return model
+    with _MODEL_LOCK:
+        if _model_loaded:
+            return model
+        if API_KEY:
+            try:
+                import google.generativeai as genai
+            except Exception:
+                genai = None
+            if genai:
+                # Força a saída em JSON. SYSTEM_PROMPT + regras de extração vão como system_instruction
+                # (fixo no modelo) em vez de serem concatenados em todo prompt: o prefixo idêntico entre
+                # chamadas é reaproveitado pelo cache implícito do Gemini e cada prompt leva só a parte dinâmica
+                try:
+                    model = genai.GenerativeModel(
+                        MODEL_NAME,
+                        system_instruction=f"{SYSTEM_PROMPT}\n\n{_PROMPT_INSTRUCTIONS}",
+                        generation_config={
+                            "response_mime_type": "application/json",
+                        }
+                    )
+                except Exception as e:
+                    # Não marca como carregado: a próxima chamada tenta de novo
+                    logger.warning("[LLM] Erro ao criar o modelo Gemini: %s", e)
+                    return None
+        _model_loaded = True
+    return model
+
+# Cache prompt -> texto devolvido pelo modelo (evita refazer a chamada para um prompt idêntico,
+# ex.: reenvio da mesma mensagem com o mesmo histórico/contexto). Valor: (texto, expira_em).
+# Guarda o texto cru: o pós-processamento de respond() roda de novo sobre o state atual.
+_RESPONSE_CACHE: Dict[str, Tuple[str, float]] = {}
+_RESPONSE_CACHE_MAX = 256
+_RESPONSE_TTL = 300.0
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+def _cached_response(prompt: str) -> Optional[str]:
+    cached = _RESPONSE_CACHE.get(prompt)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    return None
+
+def _remember_response(prompt: str, text: str) -> None:
+    # respond() roda em várias threads do threadpool: despejo e inserção sob lock
+    now = time.monotonic()
+    with _RESPONSE_CACHE_LOCK:
+        if len(_RESPONSE_CACHE) >= _RESPONSE_CACHE_MAX:
+            # Cheio: descarta primeiro o que já expirou, depois o mais antigo
+            for k in [k for k, v in _RESPONSE_CACHE.items() if v[1] <= now]:
+                del _RESPONSE_CACHE[k]
+            if len(_RESPONSE_CACHE) >= _RESPONSE_CACHE_MAX:
+                del _RESPONSE_CACHE[next(iter(_RESPONSE_CACHE))]
+        _RESPONSE_CACHE[prompt] = (text, now + _RESPONSE_TTL)
 
 SYSTEM_PROMPT = """Você é um SDR que agenda reuniões de pré-vendas.
 Você representa o produto que estamos vendendo.
@@ -193,26 +249,110 @@ def _safe_default(user_message: str) -> Dict:
         "leadPartial": lead
     }
 
-def respond(state: Dict, user_message: str) -> Dict:
-    if model is None:
-        return _safe_default(user_message)
+_SPEAKERS = {"user": "Usuário", "assistant": "Assistente"}
+
+# Regras e exemplos de extração: fixos, vão junto com o SYSTEM_PROMPT no system_instruction
+_PROMPT_INSTRUCTIONS = (
+    "⚠️ TAREFA CRÍTICA: Você DEVE analisar TODAS as mensagens do histórico E a mensagem atual para extrair TODOS os dados mencionados pelo usuário.\n"
+    "\n"
+    "🔍 EXEMPLOS DE EXTRAÇÃO DE MÚLTIPLOS DADOS:\n"
+    "- Se a mensagem for: 'Amanda Benicio, leo@example.com, SaharaCorp'\n"
+    "  → Você DEVE retornar: {\"leadPartial\": {\"name\": \"Amanda Benicio\", \"email\": \"leo@example.com\", \"company\": \"SaharaCorp\"}}\n"
+    "\n"
+    "- Se no histórico aparece: 'preciso de ajuda, quero melhorar o atendimento aos meus clientes'\n"
+    "  → Você DEVE retornar: {\"leadPartial\": {\"need\": \"preciso de ajuda, quero melhorar o atendimento aos meus clientes\"}}\n"
+    "\n"
+    "- Se a mensagem for: 'sim' (e você já tem nome e email no contexto)\n"
+    "  → Você DEVE retornar: {\"leadPartial\": {\"interestConfirmed\": true}, \"action\": {\"type\": \"OFFER_SLOTS\"}}\n"
+    "\n"
+    "📋 REGRAS DE EXTRAÇÃO (OBRIGATÓRIAS):\n"
+    "1. SEMPRE preencha o campo 'leadPartial' com TODOS os dados que você encontrar no histórico OU na mensagem atual\n"
+    "2. Se encontrar um nome (ex: 'Amanda Benicio', 'Leo Mosca Loncarovich'), coloque em 'name'\n"
+    "3. Se encontrar um email (texto com @, ex: 'leo@example.com'), coloque em 'email'\n"
+    "4. Se encontrar uma empresa (ex: 'SaharaCorp', 'Sahara Corp'), coloque em 'company'\n"
+    "5. Se encontrar um problema logístico/desafio (ex: 'tenho problemas com controle de entrada e saída', 'dificuldades com certas regiões', 'problemas de gestão de estoque'), coloque em 'need'\n"
+    "6. Se o usuário confirmar interesse ('sim', 'quero', 'tenho interesse'), coloque 'interestConfirmed': true\n"
+    "7. NÃO deixe campos vazios se os dados estiverem disponíveis no histórico ou na mensagem atual\n"
+    "8. Se a mensagem atual contém múltiplos dados separados por vírgula ou hífen, extraia TODOS\n"
+    "\n"
+    "🎯 FLUXO ESPERADO:\n"
+    "- Se o usuário forneceu nome, email, empresa e problema logístico: confirme que recebeu e pergunte sobre interesse\n"
+    "- Se o usuário confirmar interesse ('sim') e você já tem nome e email: ofereça slots (OFFER_SLOTS) mencionando que especialistas em logística irão participar da reunião para apresentar soluções para os problemas logísticos relatados\n"
+    "- NÃO repita perguntas sobre dados que já foram fornecidos\n"
+    "\n"
+)
+
+# Lembrete curto que continua no fim de cada prompt (o bloco acima vai no system_instruction)
+_PROMPT_REMINDER = "Responda APENAS com o JSON no formato especificado, SEMPRE incluindo o campo 'leadPartial' com TODOS os dados extraídos."
+
+# Moldura do aviso de re-engajamento (a nota do chat entra entre as duas partes)
+_RE_ENGAGEMENT_HEAD = "\n\n⚠️⚠️⚠️ RE-ENGAJAMENTO DETECTADO ⚠️⚠️⚠️\n"
+_RE_ENGAGEMENT_RULES = (
+    "\n"
+    "\n"
+    "REGRA CRÍTICA PARA RE-ENGAJAMENTO:\n"
+    "- IGNORE completamente qualquer indicação de 'não interesse' ou 'interestConfirmed: false' no histórico antigo\n"
+    "- Trate esta conversa como uma NOVA oportunidade, como se fosse a primeira vez falando com o lead\n"
+    "- Se o lead expressar interesse (ex: 'quero', 'tenho interesse', 'podemos marcar'), defina interestConfirmed: true IMEDIATAMENTE\n"
+    "- NÃO assuma que o lead não tem interesse baseado no histórico antigo\n"
+    "- Foque na mensagem ATUAL do usuário para determinar interesse\n"
+    "\n"
+)
+
+# Cerca de código em volta do JSON (```json ... ```), com ou sem a cerca de fechamento
+_FENCE_RE = re.compile(r"^```(?:json)?\s*(.*?)\s*(?:```)?\s*$", re.DOTALL | re.IGNORECASE)
+
+# "Sim" puro (sem ressalvas, datas ou perguntas) depois que todos os dados já foram coletados
+_YES_RE = re.compile(
+    r"^\s*(sim|quero|tenho interesse|me interessa|pode marcar)\s*[.!]*\s*$",
+    re.IGNORECASE,
+)
+
+def _fast_path(lead: Dict, context: Dict, user_message: str) -> Optional[Dict]:
+    """
+    Respostas que não precisam do Gemini. Só o caso sem ambiguidade: lead com nome, email,
+    empresa e necessidade respondendo "sim" à pergunta de interesse. O LLM devolveria
+    interestConfirmed: true + OFFER_SLOTS sem slots, que respond() já converte nesta mesma resposta;
+    o chat então busca os horários e monta a oferta. Interesse já decidido (inclusive "não") e
+    re-engajamento ficam com o LLM.
+    """
+    if context.get("slots") or context.get("is_re_engagement") or lead.get("interestConfirmed") is not None:
+        return None
+    email = lead.get("email") or ""
+    if not (lead.get("name") and "@" in email and lead.get("company") and lead.get("need")):
+        return None
+    if not _YES_RE.match(user_message):
+        return None
+    lead["interestConfirmed"] = True
+    return {
+        "reply": "Perfeito. Vou consultar a agenda e já te trago opções.",
+        "action": {"type": "ASK"},
+        "leadPartial": lead,
+    }
 
+def respond(state: Dict, user_message: str) -> Dict:
     lead = state.get("lead", {}) or {}
     context = state.get("context", {}) or {}
     slots = context.get("slots")
 
+    fast = _fast_path(lead, context, user_message)
+    if fast is not None:
+        return fast
+
+    model = _get_model()
+    if model is None:
+        return _safe_default(user_message)
+
     try:
         history = state.get("history", [])
         history_text = ""
         if history:
-            history_text = "\n\nHistórico da conversa:\n"
+            lines = ["\n\nHistórico da conversa:\n"]
             for msg in history[-10:]:  # Últimas 10 mensagens
-                role = msg.get("role", "unknown")
-                content = msg.get("content", "")
-                if role == "user":
-                    history_text += f"Usuário: {content}\n"
-                elif role == "assistant":
-                    history_text += f"Assistente: {content}\n"
+                speaker = _SPEAKERS.get(msg.get("role", "unknown"))
+                if speaker:
+                    lines.append(f"{speaker}: {msg.get('content', '')}\n")
+            history_text = "".join(lines)
         
         ctx = {"lead_so_far": lead, "available_slots": slots}
         
@@ -220,64 +360,29 @@ def respond(state: Dict, user_message: str) -> Dict:
         is_re_engagement = context.get("is_re_engagement", False)
         re_engagement_note = ""
         if is_re_engagement:
-            re_engagement_note = context.get("re_engagement_note", "")
             re_engagement_note = (
-                f"\n\n"
-                f"⚠️⚠️⚠️ RE-ENGAJAMENTO DETECTADO ⚠️⚠️⚠️\n"
-                f"{re_engagement_note}\n"
-                f"\n"
-                f"REGRA CRÍTICA PARA RE-ENGAJAMENTO:\n"
-                f"- IGNORE completamente qualquer indicação de 'não interesse' ou 'interestConfirmed: false' no histórico antigo\n"
-                f"- Trate esta conversa como uma NOVA oportunidade, como se fosse a primeira vez falando com o lead\n"
-                f"- Se o lead expressar interesse (ex: 'quero', 'tenho interesse', 'podemos marcar'), defina interestConfirmed: true IMEDIATAMENTE\n"
-                f"- NÃO assuma que o lead não tem interesse baseado no histórico antigo\n"
-                f"- Foque na mensagem ATUAL do usuário para determinar interesse\n"
-                f"\n"
+                _RE_ENGAGEMENT_HEAD + context.get("re_engagement_note", "") + _RE_ENGAGEMENT_RULES
             )
         
-        prompt = (
-            f"{SYSTEM_PROMPT}\n\n"
-            f"{re_engagement_note}"
-            f"Contexto atual do lead (dados já coletados):\n{json.dumps(ctx, ensure_ascii=False)}\n"
-            f"{history_text}\n"
-            f"Última mensagem do usuário: {user_message}\n\n"
-            f"⚠️ TAREFA CRÍTICA: Você DEVE analisar TODAS as mensagens do histórico E a mensagem atual para extrair TODOS os dados mencionados pelo usuário.\n"
-            f"\n"
-            f"🔍 EXEMPLOS DE EXTRAÇÃO DE MÚLTIPLOS DADOS:\n"
-            f"- Se a mensagem for: 'Amanda Benicio, leo@example.com, SaharaCorp'\n"
-            f"  → Você DEVE retornar: {{\"leadPartial\": {{\"name\": \"Amanda Benicio\", \"email\": \"leo@example.com\", \"company\": \"SaharaCorp\"}}}}\n"
-            f"\n"
-            f"- Se no histórico aparece: 'preciso de ajuda, quero melhorar o atendimento aos meus clientes'\n"
-            f"  → Você DEVE retornar: {{\"leadPartial\": {{\"need\": \"preciso de ajuda, quero melhorar o atendimento aos meus clientes\"}}}}\n"
-            f"\n"
-            f"- Se a mensagem for: 'sim' (e você já tem nome e email no contexto)\n"
-            f"  → Você DEVE retornar: {{\"leadPartial\": {{\"interestConfirmed\": true}}, \"action\": {{\"type\": \"OFFER_SLOTS\"}}}}\n"
-            f"\n"
-            f"📋 REGRAS DE EXTRAÇÃO (OBRIGATÓRIAS):\n"
-            f"1. SEMPRE preencha o campo 'leadPartial' com TODOS os dados que você encontrar no histórico OU na mensagem atual\n"
-            f"2. Se encontrar um nome (ex: 'Amanda Benicio', 'Leo Mosca Loncarovich'), coloque em 'name'\n"
-            f"3. Se encontrar um email (texto com @, ex: 'leo@example.com'), coloque em 'email'\n"
-            f"4. Se encontrar uma empresa (ex: 'SaharaCorp', 'Sahara Corp'), coloque em 'company'\n"
-            f"5. Se encontrar um problema logístico/desafio (ex: 'tenho problemas com controle de entrada e saída', 'dificuldades com certas regiões', 'problemas de gestão de estoque'), coloque em 'need'\n"
-            f"6. Se o usuário confirmar interesse ('sim', 'quero', 'tenho interesse'), coloque 'interestConfirmed': true\n"
-            f"7. NÃO deixe campos vazios se os dados estiverem disponíveis no histórico ou na mensagem atual\n"
-            f"8. Se a mensagem atual contém múltiplos dados separados por vírgula ou hífen, extraia TODOS\n"
-            f"\n"
-            f"🎯 FLUXO ESPERADO:\n"
-            f"- Se o usuário forneceu nome, email, empresa e problema logístico: confirme que recebeu e pergunte sobre interesse\n"
-            f"- Se o usuário confirmar interesse ('sim') e você já tem nome e email: ofereça slots (OFFER_SLOTS) mencionando que especialistas em logística irão participar da reunião para apresentar soluções para os problemas logísticos relatados\n"
-            f"- NÃO repita perguntas sobre dados que já foram fornecidos\n"
-            f"\n"
-            f"Responda APENAS com o JSON no formato especificado, SEMPRE incluindo o campo 'leadPartial' com TODOS os dados extraídos."
-        )
-
-        resp = model.generate_content(prompt)
-        text = (getattr(resp, "text", "") or "").strip()
+        prompt = "".join((
+            re_engagement_note,
+            "Contexto atual do lead (dados já coletados):\n", json.dumps(ctx, ensure_ascii=False), "\n",
+            history_text, "\n",
+            "Última mensagem do usuário: ", user_message, "\n\n",
+            _PROMPT_REMINDER,
+        ))
+
+        raw_text = _cached_response(prompt)
+        from_cache = raw_text is not None
+        if not from_cache:
+            resp = model.generate_content(prompt)
+            raw_text = (getattr(resp, "text", "") or "").strip()
+        text = raw_text
 
         if text.startswith("```"):
-            text = text.strip("`")
-            if text.lower().startswith("json"):
-                text = text[4:].strip()
+            m = _FENCE_RE.match(text)
+            if m:
+                text = m.group(1)
 
         data = json.loads(text)
 
@@ -288,6 +393,9 @@ def respond(state: Dict, user_message: str) -> Dict:
         reply = data.get("reply") or data.get("action", {}).get("reply")
         if not reply:
             return _safe_default(user_message)
+        # Só guarda respostas que passaram na validação
+        if not from_cache:
+            _remember_response(prompt, raw_text)
 
         if data.get("action", {}).get("type") == "OFFER_SLOTS" and not slots:
             data["action"] = {"type": "ASK", "reply": "Perfeito. Vou consultar a agenda e já te trago opções."}
@@ -301,4 +409,5 @@ def respond(state: Dict, user_message: str) -> Dict:
         return data
 
     except Exception as e:
+        logger.warning("[LLM] Falha ao gerar/interpretar resposta do Gemini: %s: %s", type(e).__name__, e)
         return _safe_default(user_message)
@@ -1,8 +1,15 @@
 import os
 import re
-from typing import Dict, Optional, Any, List
+import time
+import atexit
+import threading
+import logging
+from typing import Dict, Optional, Any, List, Tuple
 import httpx
 
+# Rastreamento por campo/requisição fica em DEBUG (formatação adiada); avisos e erros continuam no print
+logger = logging.getLogger(__name__)
+
 PIPEFY_API_URL = "https://api.pipefy.com/graphql"
 # Suporta ambos os nomes de variável para compatibilidade
 PIPEFY_TOKEN = os.getenv("PIPEFY_API_TOKEN") or os.getenv("PIPEFY_TOKEN")
@@ -37,6 +44,62 @@ _FIELD_IDS_CACHE: Optional[Dict[str, str]] = None
 # Flag para indicar se os field IDs foram inicializados
 _FIELD_IDS_INITIALIZED = False
 
+# Caches de busca de card (valor: (card_id, expira_em)); limite e TTLs valem para os dois.
+# Misses expiram antes para enxergar cards criados em outra instância.
+_CARD_CACHE_MAX = 4096
+_CARD_CACHE_TTL = 300.0
+_CARD_CACHE_MISS_TTL = 30.0
+# Devolvido pelos _query_* quando a consulta falha (HTTP != 200, erro GraphQL, exceção): não é
+# um "não encontrado" e não vai para o cache, senão uma falha transitória viraria card duplicado
+_LOOKUP_FAILED = object()
+
+# (pipe_id, email) -> card_id: evita varrer o pipe inteiro a cada mensagem do mesmo lead
+_CARD_BY_EMAIL_CACHE: Dict[Tuple[str, str], Tuple[Optional[str], float]] = {}
+
+# (pipe_id, padrão de título) -> card_id. Limpo inteiro quando um card é criado ou renomeado
+# (o padrão casa por substring).
+_CARD_BY_TITLE_CACHE: Dict[Tuple[str, str], Tuple[Optional[str], float]] = {}
+
+# As buscas rodam em várias threads (threadpool, BackgroundTasks): escritas nos dois caches sob lock
+_CARD_CACHE_LOCK = threading.Lock()
+
+def _cached_card(cache: Dict, key: Tuple[str, str]) -> Tuple[bool, Optional[str]]:
+    """(achou, card_id) no cache; um miss cacheado devolve (True, None)."""
+    cached = cache.get(key)
+    if cached and cached[1] > time.monotonic():
+        return True, cached[0]
+    return False, None
+
+def _remember_card(cache: Dict, key: Tuple[str, str], card_id: Optional[str]) -> None:
+    now = time.monotonic()
+    ttl = _CARD_CACHE_TTL if card_id else _CARD_CACHE_MISS_TTL
+    with _CARD_CACHE_LOCK:
+        if len(cache) >= _CARD_CACHE_MAX:
+            # Cheio: descarta primeiro o que já expirou, depois o mais antigo
+            for k in [k for k, v in cache.items() if v[1] <= now]:
+                del cache[k]
+            if len(cache) >= _CARD_CACHE_MAX:
+                del cache[next(iter(cache))]
+        cache[key] = (card_id, now + ttl)
+
+def _forget_card_by_email(pipe_id: str, email: Optional[str]) -> None:
+    """Remove o email do cache (ex.: após criar um card para ele)."""
+    if email:
+        with _CARD_CACHE_LOCK:
+            _CARD_BY_EMAIL_CACHE.pop((str(pipe_id), email.lower().strip()), None)
+
+def _forget_cards_by_title() -> None:
+    """Esvazia o cache por título (card criado/renomeado pode casar com qualquer padrão)."""
+    with _CARD_CACHE_LOCK:
+        _CARD_BY_TITLE_CACHE.clear()
+
+def is_pipefy_card_id(session_id: Optional[str]) -> bool:
+    """
+    Verifica se sessionId parece ser um card_id do Pipefy: só dígitos ASCII, 6+ caracteres.
+    UUIDs de sessão falham já no primeiro caractere não numérico.
+    """
+    return bool(session_id) and len(session_id) >= 6 and session_id.isascii() and session_id.isdigit()
+
 def _ensure_field_ids_initialized():
     """Garante que o campo motivo_nao_interesse foi inicializado (se necessário)."""
     global _FIELD_IDS_INITIALIZED
@@ -65,6 +128,13 @@ def _headers() -> Dict[str, str]:
         "Content-Type": "application/json",
     }
 
+# Cliente HTTP compartilhado: reaproveita conexões (keep-alive/TLS) entre chamadas ao GraphQL do Pipefy
+_HTTP = httpx.Client(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+atexit.register(_HTTP.close)  # vive o processo inteiro; fecha as conexões na saída
+
+def _post_graphql(payload: Dict[str, Any], timeout: float) -> httpx.Response:
+    return _HTTP.post(PIPEFY_API_URL, headers=_headers(), json=payload, timeout=timeout)
+
 def create_pipe_webhook(
     pipe_id: str,
     webhook_url: str,
@@ -117,17 +187,16 @@ def create_pipe_webhook(
     }
     
     try:
-        with httpx.Client(timeout=15.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            if r.status_code != 200:
-                r.raise_for_status()
-            
-            data = r.json()
-            if "errors" in data:
-                raise RuntimeError(f"Erro GraphQL: {data['errors']}")
-            
-            result = data.get("data", {}).get("createPipeWebhook", {})
-            return result
+        r = _post_graphql(payload, timeout=15.0)
+        if r.status_code != 200:
+            r.raise_for_status()
+        
+        data = r.json()
+        if "errors" in data:
+            raise RuntimeError(f"Erro GraphQL: {data['errors']}")
+        
+        result = data.get("data", {}).get("createPipeWebhook", {})
+        return result
     except Exception as e:
         raise
 
@@ -146,6 +215,22 @@ def find_card_by_title(pipe_id: str, title_pattern: str) -> Optional[str]:
     if not PIPEFY_TOKEN:
         return None
     
+    key = (str(pipe_id), title_pattern)
+    hit, card_id = _cached_card(_CARD_BY_TITLE_CACHE, key)
+    if hit:
+        return card_id
+    
+    card_id = _query_card_by_title(pipe_id, title_pattern)
+    if card_id is _LOOKUP_FAILED:
+        return None
+    _remember_card(_CARD_BY_TITLE_CACHE, key, card_id)
+    return card_id
+
+def _query_card_by_title(pipe_id: str, title_pattern: str) -> Any:
+    """
+    Consulta o Pipefy (sem cache) pelo primeiro card cujo título contém title_pattern.
+    Retorna o card_id, None se não houver card, ou _LOOKUP_FAILED se a consulta falhar.
+    """
     # Busca cards em TODAS as fases com limite maior (100 por fase)
     # Isso garante que encontre cards mesmo que estejam em outras fases
     query = """
@@ -177,37 +262,36 @@ def find_card_by_title(pipe_id: str, title_pattern: str) -> Optional[str]:
     }
     
     try:
-        with httpx.Client(timeout=10.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            
-            if r.status_code != 200:
-                return None
-            
-            data = r.json()
-            if "errors" in data:
-                return None
-            
-            phases = data.get("data", {}).get("pipe", {}).get("phases", [])
-            found_cards = []
-            
-            for phase in phases:
-                phase_name = phase.get("name", "Unknown")
-                cards = phase.get("cards", {}).get("edges", [])
-                for edge in cards:
-                    card = edge.get("node", {})
-                    card_title = card.get("title", "")
-                    if title_pattern in card_title:
-                        card_id = card.get("id")
-                        if card_id:
-                            found_cards.append((str(card_id), phase_name))
-            
-            if found_cards:
-                card_id, phase_name = found_cards[0]
-                return card_id
-            
-            return None
-    except Exception:
+        r = _post_graphql(payload, timeout=10.0)
+        
+        if r.status_code != 200:
+            return _LOOKUP_FAILED
+        
+        data = r.json()
+        if "errors" in data:
+            return _LOOKUP_FAILED
+        
+        phases = data.get("data", {}).get("pipe", {}).get("phases", [])
+        found_cards = []
+        
+        for phase in phases:
+            phase_name = phase.get("name", "Unknown")
+            cards = phase.get("cards", {}).get("edges", [])
+            for edge in cards:
+                card = edge.get("node", {})
+                card_title = card.get("title", "")
+                if title_pattern in card_title:
+                    card_id = card.get("id")
+                    if card_id:
+                        found_cards.append((str(card_id), phase_name))
+        
+        if found_cards:
+            card_id, phase_name = found_cards[0]
+            return card_id
+        
         return None
+    except Exception:
+        return _LOOKUP_FAILED
 
 def find_card_by_email(pipe_id: str, email: str) -> Optional[str]:
     """
@@ -229,6 +313,22 @@ def find_card_by_email(pipe_id: str, email: str) -> Optional[str]:
         return None
     
     email_normalized = email.lower().strip()
+    key = (str(pipe_id), email_normalized)
+    hit, card_id = _cached_card(_CARD_BY_EMAIL_CACHE, key)
+    if hit:
+        return card_id
+    
+    card_id = _query_card_by_email(pipe_id, email_normalized)
+    if card_id is _LOOKUP_FAILED:
+        return None
+    _remember_card(_CARD_BY_EMAIL_CACHE, key, card_id)
+    return card_id
+
+def _query_card_by_email(pipe_id: str, email_normalized: str) -> Any:
+    """
+    Consulta o Pipefy (sem cache) pelo card cujo campo de email bate com email_normalized.
+    Retorna o card_id, None se não houver card, ou _LOOKUP_FAILED se a consulta falhar.
+    """
     query = """
     query FindCardsByEmail($pipeId: ID!) {
       pipe(id: $pipeId) {
@@ -265,51 +365,50 @@ def find_card_by_email(pipe_id: str, email: str) -> Optional[str]:
     }
     
     try:
-        with httpx.Client(timeout=10.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            
-            if r.status_code != 200:
-                return None
-            
-            data = r.json()
-            if "errors" in data:
-                return None
-            
-            phases = data.get("data", {}).get("pipe", {}).get("phases", [])
-            found_cards = []
-            
-            for phase in phases:
-                phase_name = phase.get("name", "Unknown")
-                cards = phase.get("cards", {}).get("edges", [])
-                for edge in cards:
-                    card = edge.get("node", {})
-                    card_id = card.get("id")
-                    fields = card.get("fields", [])
-                    
-                    for field in fields:
-                        field_obj = field.get("field", {})
-                        field_label = field_obj.get("label", "").lower()
-                        field_value = field.get("value", "")
-                        
-                        if ("email" in field_label or "e-mail" in field_label) and field_value:
-                            card_email_normalized = field_value.lower().strip()
-                            if email_normalized == card_email_normalized:
-                                found_cards.append((str(card_id), phase_name))
-                                break
-            
-            if found_cards:
-                if len(found_cards) > 1:
-                    active_cards = [c for c in found_cards if "não interessado" not in c[1].lower() and "nao interessado" not in c[1].lower()]
-                    if active_cards:
-                        card_id, phase_name = active_cards[0]
-                        return card_id
+        r = _post_graphql(payload, timeout=10.0)
+        
+        if r.status_code != 200:
+            return _LOOKUP_FAILED
+        
+        data = r.json()
+        if "errors" in data:
+            return _LOOKUP_FAILED
+        
+        phases = data.get("data", {}).get("pipe", {}).get("phases", [])
+        found_cards = []
+        
+        for phase in phases:
+            phase_name = phase.get("name", "Unknown")
+            cards = phase.get("cards", {}).get("edges", [])
+            for edge in cards:
+                card = edge.get("node", {})
+                card_id = card.get("id")
+                fields = card.get("fields", [])
                 
-                card_id, phase_name = found_cards[0]
-                return card_id
+                for field in fields:
+                    field_obj = field.get("field", {})
+                    field_label = field_obj.get("label", "").lower()
+                    field_value = field.get("value", "")
+                    
+                    if ("email" in field_label or "e-mail" in field_label) and field_value:
+                        card_email_normalized = field_value.lower().strip()
+                        if email_normalized == card_email_normalized:
+                            found_cards.append((str(card_id), phase_name))
+                            break
+        
+        if found_cards:
+            if len(found_cards) > 1:
+                active_cards = [c for c in found_cards if "não interessado" not in c[1].lower() and "nao interessado" not in c[1].lower()]
+                if active_cards:
+                    card_id, phase_name = active_cards[0]
+                    return card_id
             
-            return None
-    except Exception:
+            card_id, phase_name = found_cards[0]
+            return card_id
+        
         return None
+    except Exception:
+        return _LOOKUP_FAILED
 
 def get_pipe_phases(pipe_id: str) -> Optional[list]:
     """
@@ -347,22 +446,21 @@ def get_pipe_phases(pipe_id: str) -> Optional[list]:
     }
     
     try:
-        with httpx.Client(timeout=10.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            if r.status_code != 200:
-                return None
-            
-            data = r.json()
-            if "errors" in data:
-                return None
-            
-            pipe_data = data.get("data", {}).get("pipe", {})
-            phases = pipe_data.get("phases", [])
-            
-            if not phases:
-                return None
-            
-            return phases
+        r = _post_graphql(payload, timeout=10.0)
+        if r.status_code != 200:
+            return None
+        
+        data = r.json()
+        if "errors" in data:
+            return None
+        
+        pipe_data = data.get("data", {}).get("pipe", {})
+        phases = pipe_data.get("phases", [])
+        
+        if not phases:
+            return None
+        
+        return phases
     except Exception:
         return None
 
@@ -482,17 +580,19 @@ def create_card(
     }
     
     try:
-        with httpx.Client(timeout=15.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            if r.status_code != 200:
-                r.raise_for_status()
-            
-            data = r.json()
-            if "errors" in data:
-                raise RuntimeError(f"Erro GraphQL: {data['errors']}")
-            
-            result = data.get("data", {}).get("createCard", {})
-            return result
+        r = _post_graphql(payload, timeout=15.0)
+        if r.status_code != 200:
+            r.raise_for_status()
+        
+        data = r.json()
+        if "errors" in data:
+            raise RuntimeError(f"Erro GraphQL: {data['errors']}")
+        
+        result = data.get("data", {}).get("createCard", {})
+        _forget_cards_by_title()
+        if fields:
+            _forget_card_by_email(pipe_id, fields.get(FIELD_NAMES["email_do_lead"]))
+        return result
     except Exception as e:
         raise
 
@@ -546,20 +646,19 @@ def get_pipe_fields(pipe_id: str) -> Optional[Dict[str, Any]]:
     }
     
     try:
-        with httpx.Client(timeout=15.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            if r.status_code != 200:
-                return None
-            
-            data = r.json()
-            if "errors" in data:
-                return None
-            
-            pipe_data = data.get("data", {}).get("pipe", {})
-            if not pipe_data:
-                return None
-            
-            return pipe_data
+        r = _post_graphql(payload, timeout=15.0)
+        if r.status_code != 200:
+            return None
+        
+        data = r.json()
+        if "errors" in data:
+            return None
+        
+        pipe_data = data.get("data", {}).get("pipe", {})
+        if not pipe_data:
+            return None
+        
+        return pipe_data
     except Exception:
         return None
 
@@ -709,7 +808,7 @@ def update_card_field(
     if resolved_field_id:
         # Se encontrou um ID real, usa ele
         actual_field_id = resolved_field_id
-        print(f"[PIPEFY] 🔍 Field ID resolvido: '{field_id}' -> '{actual_field_id}'")
+        logger.debug("[PIPEFY] Field ID resolvido: '%s' -> '%s'", field_id, actual_field_id)
     else:
         # Se não encontrou, usa o valor original (pode ser um ID numérico direto)
         actual_field_id = field_id
@@ -744,23 +843,22 @@ def update_card_field(
     }
 
     try:
-        with httpx.Client(timeout=15.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            print(f"[PIPEFY] POST /graphql (updateCardField) status: {r.status_code}")
-            
-            if r.status_code != 200:
-                print(f"[PIPEFY] Erro na resposta: {r.text[:1000]}")
-                r.raise_for_status()
-            
-            data = r.json()
-            
-            if "errors" in data:
-                print(f"[PIPEFY] Erros GraphQL: {data['errors']}")
-                raise RuntimeError(f"Erro GraphQL: {data['errors']}")
-            
-            result = data.get("data", {}).get("updateCardField", {})
-            print(f"[PIPEFY] ✅ Campo atualizado: {actual_field_id} = {value}")
-            return result
+        r = _post_graphql(payload, timeout=15.0)
+        logger.debug("[PIPEFY] POST /graphql (updateCardField) status: %s", r.status_code)
+        
+        if r.status_code != 200:
+            print(f"[PIPEFY] Erro na resposta: {r.text[:1000]}")
+            r.raise_for_status()
+        
+        data = r.json()
+        
+        if "errors" in data:
+            print(f"[PIPEFY] Erros GraphQL: {data['errors']}")
+            raise RuntimeError(f"Erro GraphQL: {data['errors']}")
+        
+        result = data.get("data", {}).get("updateCardField", {})
+        logger.debug("[PIPEFY] Campo atualizado: %s = %s", actual_field_id, value)
+        return result
 
     except Exception as e:
         print(f"[PIPEFY] ❌ Erro ao atualizar campo: {type(e).__name__}: {str(e)}")
@@ -807,23 +905,23 @@ def update_card_title(card_id: str, title: str) -> Dict[str, Any]:
     }
 
     try:
-        with httpx.Client(timeout=15.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            print(f"[PIPEFY] POST /graphql (updateCard) status: {r.status_code}")
-            
-            if r.status_code != 200:
-                print(f"[PIPEFY] Erro na resposta: {r.text[:1000]}")
-                r.raise_for_status()
-            
-            data = r.json()
-            
-            if "errors" in data:
-                print(f"[PIPEFY] Erros GraphQL: {data['errors']}")
-                raise RuntimeError(f"Erro GraphQL: {data['errors']}")
-            
-            result = data.get("data", {}).get("updateCard", {})
-            print(f"[PIPEFY] ✅ Título do card atualizado: {title}")
-            return result
+        r = _post_graphql(payload, timeout=15.0)
+        logger.debug("[PIPEFY] POST /graphql (updateCard) status: %s", r.status_code)
+        
+        if r.status_code != 200:
+            print(f"[PIPEFY] Erro na resposta: {r.text[:1000]}")
+            r.raise_for_status()
+        
+        data = r.json()
+        
+        if "errors" in data:
+            print(f"[PIPEFY] Erros GraphQL: {data['errors']}")
+            raise RuntimeError(f"Erro GraphQL: {data['errors']}")
+        
+        result = data.get("data", {}).get("updateCard", {})
+        _forget_cards_by_title()
+        print(f"[PIPEFY] ✅ Título do card atualizado: {title}")
+        return result
 
     except Exception as e:
         print(f"[PIPEFY] ⚠️ Erro ao atualizar título do card: {type(e).__name__}: {str(e)}")
@@ -866,17 +964,16 @@ def get_card_current_phase(card_id: str) -> Optional[Dict[str, Any]]:
     }
     
     try:
-        with httpx.Client(timeout=10.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            if r.status_code != 200:
-                return None
-            
-            data = r.json()
-            if "errors" in data:
-                return None
-            
-            card = data.get("data", {}).get("card", {})
-            return card.get("current_phase")
+        r = _post_graphql(payload, timeout=10.0)
+        if r.status_code != 200:
+            return None
+        
+        data = r.json()
+        if "errors" in data:
+            return None
+        
+        card = data.get("data", {}).get("card", {})
+        return card.get("current_phase")
     except Exception:
         return None
 
@@ -940,39 +1037,38 @@ def move_card_to_phase(card_id: str, phase_id: str) -> Dict[str, Any]:
     }
 
     try:
-        with httpx.Client(timeout=15.0) as client:
-            r = client.post(PIPEFY_API_URL, headers=_headers(), json=payload)
-            print(f"[PIPEFY] POST /graphql (moveCardToPhase) status: {r.status_code}")
-            
-            if r.status_code != 200:
-                print(f"[PIPEFY] Erro na resposta: {r.text[:1000]}")
-                r.raise_for_status()
-            
-            data = r.json()
-            
-            if "errors" in data:
-                errors = data['errors']
-                print(f"[PIPEFY] Erros GraphQL: {errors}")
-                # Verifica se o erro é porque o card já está na fase ou transição não permitida
-                error_msg = str(errors[0].get("message", "")) if errors else ""
-                error_code = str(errors[0].get("extensions", {}).get("code", "")) if errors else ""
-                
-                if "Cannot move" in error_msg or "PHASE_TRANSITION_ERROR" in error_code:
-                    print(f"[PIPEFY] ⚠️ Não foi possível mover o card de '{current_phase_name if current_phase else 'desconhecida'}' para fase {phase_id}")
-                    print(f"[PIPEFY] ⚠️ Erro: {error_msg}")
-                    print(f"[PIPEFY] 💡 Possíveis causas:")
-                    print(f"[PIPEFY]   1. O card precisa passar por uma fase intermediária")
-                    print(f"[PIPEFY]   2. O workflow do Pipefy não permite esta transição direta")
-                    print(f"[PIPEFY]   3. O ID da fase de destino ({phase_id}) pode estar incorreto")
-                    # Retorna um resultado parcial em vez de lançar exceção
-                    return {"warning": error_msg, "card_id": card_id, "phase_id": phase_id, "current_phase": current_phase}
-                raise RuntimeError(f"Erro GraphQL: {errors}")
+        r = _post_graphql(payload, timeout=15.0)
+        logger.debug("[PIPEFY] POST /graphql (moveCardToPhase) status: %s", r.status_code)
+        
+        if r.status_code != 200:
+            print(f"[PIPEFY] Erro na resposta: {r.text[:1000]}")
+            r.raise_for_status()
+        
+        data = r.json()
+        
+        if "errors" in data:
+            errors = data['errors']
+            print(f"[PIPEFY] Erros GraphQL: {errors}")
+            # Verifica se o erro é porque o card já está na fase ou transição não permitida
+            error_msg = str(errors[0].get("message", "")) if errors else ""
+            error_code = str(errors[0].get("extensions", {}).get("code", "")) if errors else ""
             
-            result = data.get("data", {}).get("moveCardToPhase", {})
-            card_result = result.get("card", {})
-            new_phase = card_result.get("current_phase", {})
-            print(f"[PIPEFY] ✅ Card movido para fase: {new_phase.get('name', 'Desconhecida')} (ID: {new_phase.get('id')})")
-            return result
+            if "Cannot move" in error_msg or "PHASE_TRANSITION_ERROR" in error_code:
+                print(f"[PIPEFY] ⚠️ Não foi possível mover o card de '{current_phase_name if current_phase else 'desconhecida'}' para fase {phase_id}")
+                print(f"[PIPEFY] ⚠️ Erro: {error_msg}")
+                print(f"[PIPEFY] 💡 Possíveis causas:")
+                print(f"[PIPEFY]   1. O card precisa passar por uma fase intermediária")
+                print(f"[PIPEFY]   2. O workflow do Pipefy não permite esta transição direta")
+                print(f"[PIPEFY]   3. O ID da fase de destino ({phase_id}) pode estar incorreto")
+                # Retorna um resultado parcial em vez de lançar exceção
+                return {"warning": error_msg, "card_id": card_id, "phase_id": phase_id, "current_phase": current_phase}
+            raise RuntimeError(f"Erro GraphQL: {errors}")
+        
+        result = data.get("data", {}).get("moveCardToPhase", {})
+        card_result = result.get("card", {})
+        new_phase = card_result.get("current_phase", {})
+        print(f"[PIPEFY] ✅ Card movido para fase: {new_phase.get('name', 'Desconhecida')} (ID: {new_phase.get('id')})")
+        return result
 
     except Exception as e:
         print(f"[PIPEFY] ❌ Erro ao mover card: {type(e).__name__}: {str(e)}")
@@ -1188,8 +1284,6 @@ def update_card_lead_fields(
                 print(f"[PIPEFY] ⚠️ Erro ao atualizar motivo de não interesse: {type(e).__name__}: {str(e)}")
                 print(f"[PIPEFY] 💡 Verifique se o field_id '{motivo_field_id}' está correto e se o campo existe no Pipefy")
                 print(f"[PIPEFY] 💡 O field_id atual é: '{motivo_field_id}' (pode ser que precise ser o ID numérico do campo)")
-                import traceback
-                traceback.print_exc()
                 results["motivo_nao_interesse"] = f"error: {str(e)}"
         else:
             print(f"[PIPEFY] ⚠️ Campo 'motivo_nao_interesse' não encontrado no Pipefy")
@@ -7,12 +7,13 @@ import sys
 # Configura variável de ambiente para Vercel
 os.environ.setdefault("VERCEL", "1")
 
-# Carrega .env apenas se existir (não necessário no Vercel)
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
+# Carrega .env apenas se existir (não necessário no Vercel; LOAD_DOTENV=0 desliga a busca)
+if os.getenv("LOAD_DOTENV", "1") == "1":
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
 
 # Tratamento de erros na importação
 app = None
@@ -41,9 +42,12 @@ try:
         app.include_router(pipefy.router, prefix="/api", tags=["pipefy"])
         print("[MAIN] ✅ Routers registrados com sucesso", file=sys.stderr)
         
-        # Inicializa field IDs do Pipefy na inicialização do app
+        # Inicializa banco e field IDs do Pipefy na inicialização do app
+        # (uma vez por processo, fora do caminho das requisições)
         @app.on_event("startup")
         async def startup_event():
+            from app.models.db import init_db
+            init_db()
             try:
                 from app.core.pipefy import initialize_field_ids
                 print("[MAIN] 🔄 Inicializando field IDs do Pipefy...", file=sys.stderr)
@@ -1,9 +1,13 @@
 from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlalchemy import Index
 from typing import Optional
 from datetime import datetime
 import os
 
 class Message(SQLModel, table=True):
+    # _recent_messages (histórico + expiração no chat) filtra por sessão e ordena por ts DESC com LIMIT
+    __table_args__ = (Index("ix_messages_session_ts", "session_id", "ts"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: str
     role: str
@@ -23,7 +27,8 @@ class Lead(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: str
     name: Optional[str] = None
-    email: Optional[str] = None
+    # Buscas de card existente por email (chat e schedule)
+    email: Optional[str] = Field(default=None, index=True)
     company: Optional[str] = None
     need: Optional[str] = None
     interest_confirmed: Optional[bool] = None
@@ -51,7 +56,7 @@ def get_session():
     return Session(engine)
 
 def get_lead_by_session(db: Session, session_id: str) -> Lead:
-    stmt = select(Lead).where(Lead.session_id == session_id)
+    stmt = select(Lead).where(Lead.session_id == session_id).limit(1)
     lead = db.exec(stmt).first()
     if not lead:
         lead = Lead(session_id=session_id)